@@ -7,44 +7,94 @@ import time
 import threading
 import numpy as np
 from CameraCalibration.CalibrationConfig import *
+from CameraCalibration.undistort_maps import load_undistort_maps
+from frame_ring import FrameRing
+from pipeline_stats import PipelineStats
 
 if sys.version_info.major == 2:
     print('Please run this program with python3!')
     sys.exit(0)
 
 class Camera:
-    def __init__(self, resolution=(640, 480)):
+    def __init__(self, resolution=(640, 480), passthrough=False, device=None, fps=30, calibration_path=None):
         self.cap = None
         self.width = resolution[0]
         self.height = resolution[1]
+        # device 为 V4L2 设备路径或序号, None 时自动选择(打开时用 -1, 重连时用 0)
+        self.device = device
+        self.fps = fps
+        # 标定参数文件, 每个摄像头可以使用各自的标定
+        self.calibration_path = calibration_param_path + '.npz' if calibration_path is None else calibration_path
         self.frame = None
+        # 直通模式: 摄像头直接输出 MJPG, 压缩数据原样转发给观看者(未去畸变)
+        # 只有在 lease_frame 需要像素时才解码和去畸变, 同一帧只解码一次
+        self.passthrough = passthrough
+        self.jpeg = None
+        self.decoded_seq = 0  # 最近一次解码的画面序号
+        self.decode_lock = threading.Lock()
+        self.corrupt_frames = 0  # 不是完整 JPEG 而丢弃的帧数
+        # 每发布一帧序号加1, 等待新画面的线程由 frame_cond 唤醒
+        self.frame_seq = 0
+        self.frame_time = None  # 最新一帧的采集时间 time.monotonic()
+        self.frame_cond = threading.Condition()
+        # 采集和去畸变结果都写入预分配的缓冲区, 画面以只读视图的形式发布, 读者通过 lease_frame 租用
+        self.capture_buf = None
+        self.ring = None
+        self.dropped_frames = 0  # 缓冲区全部被读者占用而丢弃的帧数
+        # 各阶段距采集(cap.read 返回)的耗时: process 为去畸变完成, decode 为直通模式下按需解码完成
+        self.latency = PipelineStats()
         self.opened = False
-        #加载参数(load parameters)
-        self.param_data = np.load(calibration_param_path + '.npz')
-
-        #获取参数(obtain parameters)
-        self.mtx = self.param_data['mtx_array']
-        self.dist = self.param_data['dist_array']
-        self.newcameramtx, roi = cv2.getOptimalNewCameraMatrix(self.mtx, self.dist, (self.width, self.height), 0, (self.width, self.height))
-        self.mapx, self.mapy = cv2.initUndistortRectifyMap(self.mtx, self.dist, None, self.newcameramtx, (self.width,self.height), 5)
+        # 采集监控的状态: streaming 正常采集, reconnecting 按指数退避重新连接, closed 已关闭
+        self.state = 'closed'
+        self.wakeup = threading.Event()  # 打开/关闭摄像头时唤醒等待中的采集线程
+        self.reconnect_delay = 0.5  # 第一次重连立即进行, 之后从 reconnect_delay 开始每次加倍
+        self.max_reconnect_delay = 10.0
+        self.retry_delay = 0.0
+        self.reconnects = 0  # 重新打开摄像头的次数
+        self.last_error = None
+        self.down_since = None  # 本次断开的开始时间
+        self.downtime = 0.0  # 之前各次断开的累计时长(s)
+        # 映射表与采集分辨率有关, 先按与输出相同的分辨率加载, 收到分辨率不同的画面时重新加载
+        # 映射表缓存在 map_cache_path, 标定参数不变时启动不需要重新计算
+        self.map_size = (self.width, self.height)
+        self.map1, self.map2 = self.load_maps(self.map_size)
         
         self.th = threading.Thread(target=self.camera_task, args=(), daemon=True)
         self.th.start()
 
+    def load_maps(self, native_size):
+        return load_undistort_maps(self.calibration_path, native_size, (self.width, self.height), map_cache_path)
+
+    def open_capture(self, index):
+        if self.device is not None:
+            index = self.device
+        # 设备路径直接用 V4L2 后端打开, 不经过 FFmpeg/GStreamer
+        cap = cv2.VideoCapture(index, cv2.CAP_V4L2) if isinstance(index, str) else cv2.VideoCapture(index)
+        if self.passthrough:
+            # 关闭 RGB 转换后 V4L2 后端直接返回摄像头输出的 JPEG 数据
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'))
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+            cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        else:
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('Y', 'U', 'Y', 'V'))
+        cap.set(cv2.CAP_PROP_FPS, self.fps)
+        cap.set(cv2.CAP_PROP_SATURATION, 40)
+        return cap
+
     def camera_open(self):
         try:
             # --- FIX: Use -1 to auto-detect the camera ---
-            self.cap = cv2.VideoCapture(-1) 
-            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('Y', 'U', 'Y', 'V'))
-            self.cap.set(cv2.CAP_PROP_FPS, 30)
-            self.cap.set(cv2.CAP_PROP_SATURATION, 40)
+            self.cap = self.open_capture(-1)
             self.opened = True
+            self.wakeup.set()
         except Exception as e:
             print('打开摄像头失败:', e)
 
     def camera_close(self):
         try:
             self.opened = False
+            self.wakeup.set()
             time.sleep(0.2)
             if self.cap is not None:
                 self.cap.release()
@@ -53,35 +103,219 @@ class Camera:
         except Exception as e:
             print('关闭摄像头失败:', e)
 
+    def acquire_buffer(self, frame):
+        # 返回可写入输出画面的缓冲区序号, 没有空闲缓冲区时返回 None
+        shape = (self.height, self.width) + frame.shape[2:]
+        with self.frame_cond:
+            if self.ring is None or self.ring.shape != shape or self.ring.dtype != frame.dtype:
+                self.ring = FrameRing(self.frame_cond, shape, frame.dtype)
+            return self.ring.acquire()
+
+    def publish_buffer(self, index, timestamp):
+        with self.frame_cond:
+            self.ring.latest = index
+            self.frame = self.ring.views[index]
+            self.frame_seq += 1
+            self.frame_time = timestamp
+            self.frame_cond.notify_all()
+
+    def clear_frame(self):
+        with self.frame_cond:
+            self.frame = None
+            self.jpeg = None
+
+    def publish_jpeg(self, jpeg, timestamp):
+        with self.frame_cond:
+            self.jpeg = jpeg
+            self.frame_seq += 1
+            self.frame_time = timestamp
+            self.frame_cond.notify_all()
+
+    def wait_for_jpeg(self, after_seq=0, timeout=None):
+        # 直通模式: 等待序号大于 after_seq 的 JPEG, 返回 (序号, 采集时间, JPEG 数据), 超时返回 None
+        with self.frame_cond:
+            if not self.frame_cond.wait_for(lambda: self.jpeg is not None and self.frame_seq > after_seq, timeout):
+                return None
+            return self.frame_seq, self.frame_time, self.jpeg
+
+    def lease_decoded(self, after_seq, timeout):
+        # 直通模式的 lease_frame: 解码最新的 JPEG 并去畸变, 已解码过的画面直接租用
+        if self.wait_for_jpeg(after_seq, timeout) is None:
+            return None
+        with self.decode_lock:
+            with self.frame_cond:
+                seq, timestamp, jpeg = self.frame_seq, self.frame_time, self.jpeg
+                if jpeg is None:
+                    return None
+                if self.decoded_seq == seq:
+                    return self.ring.lease(self.ring.latest, seq, timestamp)
+            frame_tmp = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+            if frame_tmp is None:
+                print('JPEG 解码失败')
+                return None
+            size = (frame_tmp.shape[1], frame_tmp.shape[0])
+            if size != self.map_size:
+                self.map1, self.map2 = self.load_maps(size)
+                self.map_size = size
+            index = self.acquire_buffer(frame_tmp)
+            if index is None:
+                self.dropped_frames += 1
+                return None
+            cv2.remap(frame_tmp, self.map1, self.map2, cv2.INTER_LINEAR, dst=self.ring.buffers[index])
+            self.latency.record('decode', time.monotonic() - timestamp)
+            with self.frame_cond:
+                self.ring.latest = index
+                self.frame = self.ring.views[index]
+                self.decoded_seq = seq
+                return self.ring.lease(index, seq, timestamp)
+
+    def lease_frame(self, after_seq=0, timeout=None):
+        # 等待序号大于 after_seq 的画面并租用, 返回 FrameLease, 超时返回 None
+        # 租用期间画面不会被覆盖, 用完后调用 release() 或使用 with 语句
+        if self.passthrough:
+            return self.lease_decoded(after_seq, timeout)
+        with self.frame_cond:
+            if not self.frame_cond.wait_for(lambda: self.frame is not None and self.frame_seq > after_seq, timeout):
+                return None
+            return self.ring.lease(self.ring.latest, self.frame_seq, self.frame_time)
+
+    def wait_for_frame(self, after_seq=0, timeout=None):
+        # 等待序号大于 after_seq 的画面, 返回 (序号, 采集时间, 画面拷贝), 超时返回 None
+        lease = self.lease_frame(after_seq, timeout)
+        if lease is None:
+            return None
+        with lease:
+            return lease.seq, lease.timestamp, lease.frame.copy()
+
+    def read_frame(self):
+        ret, self.capture_buf = self.cap.read(self.capture_buf)
+        timestamp = time.monotonic()
+        if ret:
+            frame_tmp = self.capture_buf
+            size = (frame_tmp.shape[1], frame_tmp.shape[0])
+            if size != self.map_size:
+                self.map1, self.map2 = self.load_maps(size)
+                self.map_size = size
+            index = self.acquire_buffer(frame_tmp)
+            if index is None:
+                self.dropped_frames += 1
+                return True
+            cv2.remap(frame_tmp, self.map1, self.map2, cv2.INTER_LINEAR, dst=self.ring.buffers[index])
+            self.latency.record('process', time.monotonic() - timestamp)
+            self.publish_buffer(index, timestamp)
+        return ret
+
+    def read_jpeg(self):
+        ret, data = self.cap.read()
+        timestamp = time.monotonic()
+        if ret:
+            if data.ndim == 3:
+                # 摄像头不支持 MJPG, 后端返回的是已解码的画面, 在本地编码
+                ret, data = cv2.imencode('.jpg', data)
+                if not ret:
+                    print('JPEG 编码失败')
+                    return True
+            jpeg = data.tobytes()
+            if not jpeg.startswith(b'\xff\xd8'):
+                self.corrupt_frames += 1
+                return True
+            self.publish_jpeg(jpeg, timestamp)
+        return ret
+
+    def set_state(self, state):
+        if state == self.state:
+            return
+        now = time.monotonic()
+        if state == 'reconnecting':
+            self.down_since = now
+        elif self.down_since is not None:
+            self.downtime += now - self.down_since
+            self.down_since = None
+        if state != 'reconnecting':
+            self.retry_delay = 0.0
+        if state == 'streaming':
+            if self.state == 'reconnecting':
+                print('摄像头已重新连接')
+        self.state = state
+
+    def reconnect(self, error):
+        # 释放摄像头, 等待退避时间后重新打开, 等待期间关闭摄像头会立即返回
+        if self.state != 'reconnecting':
+            print('摄像头断开, 正在重新连接:', error)
+        self.last_error = error
+        self.set_state('reconnecting')
+        self.clear_frame()
+        self.capture_buf = None
+        cap, self.cap = self.cap, None
+        if cap is not None:
+            cap.release()
+        # 先清除再检查, 检查之后的打开/关闭操作仍会唤醒等待
+        self.wakeup.clear()
+        if self.retry_delay and self.opened:
+            self.wakeup.wait(self.retry_delay)
+        self.retry_delay = min(max(self.retry_delay * 2, self.reconnect_delay), self.max_reconnect_delay)
+        if not self.opened:
+            return
+        self.reconnects += 1
+        cap = self.open_capture(0)
+        if self.opened:
+            self.cap = cap
+        else:
+            cap.release()
+
+    def status(self):
+        now = time.monotonic()
+        down = now - self.down_since if self.down_since is not None else 0.0
+        return {
+            'state': self.state,
+            'reconnects': self.reconnects,
+            'retry_delay_s': self.retry_delay,
+            'last_error': self.last_error,
+            'down_s': round(down, 3),
+            'downtime_s': round(self.downtime + down, 3),
+            'frame_seq': self.frame_seq,
+            'dropped_frames': self.dropped_frames,
+            'corrupt_frames': self.corrupt_frames,
+        }
+
     def camera_task(self):
+        # 采集监控: 正常采集时阻塞在 read() 上等待摄像头的下一帧, 不空转
+        # 打开或读取失败时进入 reconnecting, 关闭时等待 camera_open 唤醒
         while True:
+            if not self.opened:
+                self.set_state('closed')
+                self.wakeup.clear()
+                if not self.opened:
+                    self.wakeup.wait()
+                continue
             try:
-                if self.opened and self.cap.isOpened():
-                    ret, frame_tmp = self.cap.read()
-                    if ret:
-                        frame_resize = cv2.resize(frame_tmp, (self.width, self.height), interpolation=cv2.INTER_NEAREST)
-                        self.frame = cv2.remap(frame_resize, self.mapx, self.mapy, cv2.INTER_LINEAR)
-                    else:
-                        # If reading fails, try to reconnect
-                        self.frame = None
-                        self.cap.release()
-                        self.cap = cv2.VideoCapture(0)
-                elif self.opened:
-                    # If not open, try to open it
-                    self.cap = cv2.VideoCapture(0)
+                cap = self.cap
+                if cap is not None and cap.isOpened():
+                    ret = self.read_jpeg() if self.passthrough else self.read_frame()
+                    if ret or not self.opened:
+                        if ret:
+                            self.set_state('streaming')
+                        continue
+                    error = '读取画面失败'
                 else:
-                    time.sleep(0.01)
+                    error = '打开摄像头失败'
             except Exception as e:
+                if not self.opened:
+                    continue
                 print('获取摄像头画面出错:', e)
-                time.sleep(0.01)
+                error = str(e)
+            self.reconnect(error)
 
 if __name__ == '__main__':
     my_camera = Camera()
     my_camera.camera_open()
+    seq = 0
     while True:
-        img = my_camera.frame
-        if img is not None:
-            cv2.imshow('img', img)
+        lease = my_camera.lease_frame(seq, timeout=1.0)
+        if lease is not None:
+            with lease:
+                seq = lease.seq
+                cv2.imshow('img', lease.frame)
             key = cv2.waitKey(1)
             if key == 27:
                 break
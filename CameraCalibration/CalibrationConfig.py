@@ -15,3 +15,6 @@ calibration_param_path = '/home/pi/MasterPi/CameraCalibration/calibration_param'
 
 #映射参数存储路径(the storage path for the mapping parameters)
 map_param_path = '/home/pi/MasterPi/CameraCalibration/map_param'
+
+#去畸变映射表缓存目录(the cache directory for the undistortion maps)
+map_cache_path = '/home/pi/MasterPi/CameraCalibration/map_cache'
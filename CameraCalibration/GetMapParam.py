@@ -4,26 +4,20 @@ import cv2
 import time
 import numpy as np
 from CalibrationConfig import *
+from undistort_maps import load_undistort_maps
 
 #获取像素与实际距离的映射系数, 按space键获取参数，按其他任意键退出(Get the mapping coefficient between pixel and actual distance. Press 'space' to obtain parameters, and press any other key to exit.)
 #注意:获取参数需要摄像头画面能完整的看到整个棋盘，且十字正对棋盘(Note:for obtaining the parameters, the camera must be able to fully capture the entire chessboard and the cross must be aligned with the chessboard.)
 
 cap = cv2.VideoCapture(-1)
 
-#加载参数(load parameters)
-param_data = np.load(calibration_param_path + '.npz')
-
-#获取参数(obtain parameters)
-mtx = param_data['mtx_array']
-dist = param_data['dist_array']
-
 while True:
     ret, frame = cap.read()
     if ret:
         h, w = frame.shape[:2]
         break
-newcameramtx, roi = cv2.getOptimalNewCameraMatrix(mtx, dist, (w, h), 0, (w, h))
-mapx, mapy = cv2.initUndistortRectifyMap(mtx, dist, None, newcameramtx, (w,h), 5)
+#加载去畸变映射表, 与 Camera 共用缓存(load the undistortion maps, sharing the cache with Camera)
+map1, map2 = load_undistort_maps(calibration_param_path + '.npz', (w, h), (w, h), map_cache_path)
 
 # termination criteria
 criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
@@ -32,7 +26,7 @@ while True:
     ret, Frame = cap.read()
     if ret:
         frame = Frame.copy()
-        dst = cv2.remap(frame, mapx, mapy, cv2.INTER_LINEAR)
+        dst = cv2.remap(frame, map1, map2, cv2.INTER_LINEAR)
         img = dst.copy()
 
         cv2.line(dst, (0, int(h / 2)), (w, int(h / 2)), (0, 0, 255), 2)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# encoding:utf-8
+# 去畸变映射表的生成与磁盘缓存
+# 缓存为 .npy 文件, 以内存映射方式读取, 文件名包含标定文件内容的哈希, 标定更新后自动重新生成
+# 文件名还包含标定文件路径的哈希, 多个摄像头用不同的标定文件时各自保留缓存
+import os
+import glob
+import hashlib
+import cv2
+import numpy as np
+
+def build_undistort_maps(mtx, dist, native_size, output_size, alpha=0, map_type=cv2.CV_16SC2):
+    # 直接从采集分辨率 native_size 映射到输出分辨率 output_size, 缩放和去畸变只需一次 remap
+    # 标定参数对应输出分辨率, 按采集分辨率缩放相机内参(以像素中心对齐)
+    width, height = output_size
+    newcameramtx, roi = cv2.getOptimalNewCameraMatrix(mtx, dist, (width, height), alpha, (width, height))
+    sx = native_size[0] / width
+    sy = native_size[1] / height
+    native_mtx = np.array(mtx, dtype=np.float64)
+    native_mtx[0, :2] *= sx
+    native_mtx[1, 1] *= sy
+    native_mtx[0, 2] = (native_mtx[0, 2] + 0.5) * sx - 0.5
+    native_mtx[1, 2] = (native_mtx[1, 2] + 0.5) * sy - 0.5
+    map1, map2 = cv2.initUndistortRectifyMap(native_mtx, dist, None, newcameramtx, (width, height), map_type)
+    return map1, map2
+
+def load_undistort_maps(calibration_path, native_size, output_size, cache_dir=None, alpha=0, map_type=cv2.CV_16SC2):
+    # 优先读取缓存, 没有缓存或 cache_dir 为 None 时生成, 生成后写入缓存并删除同一标定文件, 同规格的旧缓存
+    with open(calibration_path, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:16]
+    if cache_dir is not None:
+        source = hashlib.sha1(os.path.abspath(calibration_path).encode()).hexdigest()[:8]
+        prefix = os.path.join(cache_dir, 'undistort_%s_%dx%d_%dx%d_a%g_t%d_' % ((source,) + native_size + output_size + (alpha, map_type)))
+        paths = (prefix + digest + '_map1.npy', prefix + digest + '_map2.npy')
+        try:
+            return tuple(np.load(path, mmap_mode='r') for path in paths)
+        except (OSError, ValueError):
+            pass
+
+    param_data = np.load(calibration_path)
+    maps = build_undistort_maps(param_data['mtx_array'], param_data['dist_array'], native_size, output_size, alpha, map_type)
+    if cache_dir is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            for old in glob.glob(prefix + '*.npy'):
+                if old not in paths:
+                    os.remove(old)
+            for path, data in zip(paths, maps):
+                # 先写临时文件再改名, 避免其他进程读到不完整的缓存
+                tmp = '%s.%d.tmp' % (path, os.getpid())
+                with open(tmp, 'wb') as f:
+                    np.save(f, data)
+                os.replace(tmp, path)
+        except OSError as e:
+            print('写入映射表缓存失败:', e)
+    return maps
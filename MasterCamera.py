@@ -32,10 +32,14 @@ print(f"My IP address is: {my_ip}")
 def cameraConnection():
     my_camera = Camera()
     my_camera.camera_open()
+    seq = 0
     while True:
-        img = my_camera.frame
-        if img is not None:
-            cv2.imshow('img', img)
+        # 租用画面, 显示期间采集线程不会覆盖它
+        lease = my_camera.lease_frame(seq, timeout=1.0)
+        if lease is not None:
+            with lease:
+                seq = lease.seq
+                cv2.imshow('img', lease.frame)
             key = cv2.waitKey(1)
             if key == 27:
                 break
@@ -94,10 +98,13 @@ if __name__ == '__main__':
         connection = False
         my_camera = Camera.Camera()
         my_camera.camera_open()
+        seq = 0
         while True:
-            img = my_camera.frame
-            if img is not None:
-                cv2.imshow('img', img)
+            lease = my_camera.lease_frame(seq, timeout=1.0)
+            if lease is not None:
+                with lease:
+                    seq = lease.seq
+                    cv2.imshow('img', lease.frame)
                 key = cv2.waitKey(1)
                 if key == 27:
                     break
@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
+import os
 from flask import Flask, render_template, Response, request, jsonify
-import cv2
 import time
 import threading
 import mechanum
 import swivel
 import lampControl
-from Camera import Camera # Using the dedicated Camera class
+from common.board_registry import get_board, get_scheduler
+from camera_manager import CameraManager
+from jpeg_encoder import select_encoder
+from segment_recorder import SegmentRecorder
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
@@ -23,12 +26,45 @@ robot_state = {
 # A lock to ensure that the state is accessed by only one thread at a time.
 state_lock = threading.Lock()
 
+# The control board and command scheduler shared with mechanum and swivel
+board = get_board()
+scheduler = get_scheduler()
+
 # --- Camera Initialization ---
-# Create an instance of the Camera class and open the camera
-my_camera = Camera()
-my_camera.camera_open()
+# Every USB camera found gets its own capture pipeline, served at /video_feed/<name>
+# (cam0, cam1, ...); /video_feed serves the first one. CAMERAS overrides the
+# enumeration with explicit names and devices, e.g. CAMERAS=front=/dev/video0,rear=/dev/video2
+# With CAMERA_WORKER=1 capture and undistortion run in a separate process that
+# writes frames into shared memory, keeping video work off this process's GIL.
+# With CAMERA_PASSTHROUGH=1 the camera delivers MJPEG which is forwarded to
+# /video_feed untouched (not undistorted); frames are decoded only on demand.
+# The two cannot be combined: the capture process only shares decoded frames.
+# Each frame is encoded once and shared by every /video_feed client.
+# JPEG_ENCODER picks the backend (opencv, turbojpeg, simplejpeg; default: fastest
+# available) and JPEG_PRESET a quality/chroma-subsampling preset (low, medium, high, max).
+# CHANGE_THRESHOLD (max grey-level change on a 32x24 thumbnail, e.g. 6) skips encoding
+# and sending frames that have not changed, still sending one every HEARTBEAT seconds.
+camera_configs = None
+if os.environ.get('CAMERAS'):
+    camera_configs = []
+    for entry in os.environ['CAMERAS'].split(','):
+        name, _, device = entry.partition('=')
+        camera_configs.append({'name': name.strip(), 'device': device.strip() or None})
+cameras = CameraManager(camera_configs,
+                        passthrough=os.environ.get('CAMERA_PASSTHROUGH') == '1',
+                        worker=os.environ.get('CAMERA_WORKER') == '1',
+                        encoder=select_encoder(os.environ.get('JPEG_ENCODER', 'auto'),
+                                               preset=os.environ.get('JPEG_PRESET')),
+                        change_threshold=float(os.environ['CHANGE_THRESHOLD']) if os.environ.get('CHANGE_THRESHOLD') else None,
+                        heartbeat=float(os.environ.get('HEARTBEAT', 2.0)))
+cameras.open_all()
 # Allow some time for the camera to initialize properly
 time.sleep(1.0)
+# Background recorders by camera name, controlled through /record/start and /record/stop.
+# Segments are written under RECORD_DIR (default: recordings/ next to this file).
+record_dir = os.environ.get('RECORD_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recordings'))
+recorders = {}
+recorders_lock = threading.Lock()
 
 def robot_control_loop():
     """
@@ -44,40 +80,43 @@ def robot_control_loop():
             gimbal_cmd = robot_state['gimbal_command']
             swivel_angle = robot_state['swivel_angle']
 
-        # --- Motor Control ---
-        fb_velocity = mechanum.sepVel(speed) or 0
-        lr_velocity = (-0.0528 * speed ** 2) + (9.16 * speed) - 46
-
-        if movement_cmd == 'forward':
-            mechanum.moveForward(fb_velocity)
-        elif movement_cmd == 'backward':
-            mechanum.moveBackward(fb_velocity)
-        elif movement_cmd == 'left':
-            mechanum.moveLeft(lr_velocity)
-        elif movement_cmd == 'right':
-            mechanum.moveRight(lr_velocity)
-        elif movement_cmd == 'turn_left':
-            mechanum.turn(-2) # Using a fixed turn speed for simplicity
-        elif movement_cmd == 'turn_right':
-            mechanum.turn(2)  # Using a fixed turn speed
-        elif movement_cmd == 'stop':
-            mechanum.stop()
-
-        # --- Gimbal Control (Continuous) ---
-        new_swivel_angle = swivel_angle
-        if gimbal_cmd == 'left':
-            new_swivel_angle += 50  # Increment for movement
-        elif gimbal_cmd == 'right':
-            new_swivel_angle -= 50
-
-        # Clamp the angle to the valid range [500, 2500]
-        new_swivel_angle = max(500, min(2500, new_swivel_angle))
-
-        # Only send command if the angle has changed
-        if new_swivel_angle != swivel_angle:
-            swivel.rotateCamera(new_swivel_angle, 0.1) # Faster update time
-            with state_lock:
-                robot_state['swivel_angle'] = new_swivel_angle
+        # Collect this iteration's motor and swivel commands and send them together when the tick ends,
+        # so same-tick PWM servo updates go out as one frame (mechanum and swivel use this scheduler too)
+        with scheduler.tick():
+            # --- Motor Control ---
+            fb_velocity = mechanum.sepVel(speed) or 0
+            lr_velocity = (-0.0528 * speed ** 2) + (9.16 * speed) - 46
+
+            if movement_cmd == 'forward':
+                mechanum.moveForward(fb_velocity)
+            elif movement_cmd == 'backward':
+                mechanum.moveBackward(fb_velocity)
+            elif movement_cmd == 'left':
+                mechanum.moveLeft(lr_velocity)
+            elif movement_cmd == 'right':
+                mechanum.moveRight(lr_velocity)
+            elif movement_cmd == 'turn_left':
+                mechanum.turn(-2) # Using a fixed turn speed for simplicity
+            elif movement_cmd == 'turn_right':
+                mechanum.turn(2)  # Using a fixed turn speed
+            elif movement_cmd == 'stop':
+                mechanum.stop()
+
+            # --- Gimbal Control (Continuous) ---
+            new_swivel_angle = swivel_angle
+            if gimbal_cmd == 'left':
+                new_swivel_angle += 50  # Increment for movement
+            elif gimbal_cmd == 'right':
+                new_swivel_angle -= 50
+
+            # Clamp the angle to the valid range [500, 2500]
+            new_swivel_angle = max(500, min(2500, new_swivel_angle))
+
+            # Only send command if the angle has changed
+            if new_swivel_angle != swivel_angle:
+                swivel.rotateCamera(new_swivel_angle, 0.1) # Faster update time
+                with state_lock:
+                    robot_state['swivel_angle'] = new_swivel_angle
 
         # Loop delay to prevent 100% CPU usage
         time.sleep(0.05) # Loop runs ~20 times per second
@@ -89,33 +128,107 @@ def index():
     return render_template('index.html')
 
 # --- Video Streaming ---
-def gen_frames():
+@app.route('/video_feed')
+@app.route('/video_feed/<name>')
+def video_feed(name=None):
     """
-    A generator function that captures frames from the camera,
-    encodes them, and yields them for the video stream.
+    This route streams the video frames of the named camera (default: the first one).
+    Optional query parameters: fps (frame rate cap), quality (JPEG quality 1-100),
+    scale (0.1-1.0), or adaptive=1 with target_ms to let the stream step quality,
+    resolution and frame rate to hold the per-frame send time under target_ms.
+    quality and scale are rounded to the nearest of a few fixed steps so clients share encodes.
     """
-    while True:
-        frame = my_camera.frame
-        if frame is None:
-            time.sleep(0.1) # Wait a bit if no frame is available
-            continue
-
-        # Encode the frame in JPEG format
-        ret, buffer = cv2.imencode('.jpg', frame)
-        if not ret:
-            print("Failed to encode frame")
-            continue
-            
-        frame_bytes = buffer.tobytes()
-        
-        # Yield the frame in the format required for multipart streaming
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+    if name is not None and name not in cameras.cameras:
+        return jsonify(status="error", message=f"unknown camera '{name}'", cameras=cameras.names()), 404
+    fps = request.args.get('fps', type=float)
+    quality = request.args.get('quality', type=int)
+    scale = request.args.get('scale', 1.0, type=float)
+    adaptive = request.args.get('adaptive', '0').lower() in ('1', 'true', 'yes')
+    target_ms = request.args.get('target_ms', 200.0, type=float)
+    if fps is not None and fps <= 0:
+        fps = None
+    if quality is not None:
+        quality = max(1, min(100, quality))
+    scale = max(0.1, min(1.0, scale))
+    stream = cameras.broadcaster(name).stream(fps=fps, quality=quality, scale=scale,
+                                              adaptive=adaptive, target_latency=max(target_ms, 1.0) / 1000.0)
+    return Response(stream, mimetype='multipart/x-mixed-replace; boundary=frame')
 
-@app.route('/video_feed')
-def video_feed():
-    """This route streams the video frames."""
-    return Response(gen_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+@app.route('/camera_status')
+def camera_status():
+    """Returns each camera's device and capture supervisor state (streaming/reconnecting/closed), reconnect attempts and downtime."""
+    return jsonify(cameras.status())
+
+@app.route('/video_latency')
+@app.route('/video_latency/<name>')
+def video_latency(name=None):
+    """
+    Returns rolling histograms (microseconds) of how old a frame is at each stage:
+    process (undistorted), encode, sent (yield to the client completed), plus write
+    (time spent in the yield itself) and dropped/skipped frame counters.
+    """
+    if name is not None and name not in cameras.cameras:
+        return jsonify(status="error", message=f"unknown camera '{name}'", cameras=cameras.names()), 404
+    return jsonify(cameras.broadcaster(name).latency_stats())
+
+@app.route('/video_stats')
+@app.route('/video_stats/<name>')
+def video_stats(name=None):
+    """Returns the broadcaster's viewers, encode count and each client's stream settings."""
+    if name is not None and name not in cameras.cameras:
+        return jsonify(status="error", message=f"unknown camera '{name}'", cameras=cameras.names()), 404
+    return jsonify(cameras.broadcaster(name).stats())
+
+# --- Recording ---
+@app.route('/record/start', methods=['POST'])
+def record_start():
+    """
+    Starts recording a camera to rotated segments on disk.
+    JSON body (all optional): camera (name, default: the first one),
+    source ('auto', 'frames' or 'jpeg'), codec (e.g. 'MJPG' or 'avc1' for frames),
+    segment_seconds (default 60), keep_segments (delete older segments beyond this count).
+    """
+    data = request.get_json(silent=True) or {}
+    name = data.get('camera') or cameras.default
+    if name not in cameras.cameras:
+        return jsonify(status="error", message=f"unknown camera '{name}'", cameras=cameras.names()), 404
+    keep_segments = data.get('keep_segments')
+    if keep_segments is not None and (type(keep_segments) is not int or keep_segments < 1):
+        return jsonify(status="error", message="keep_segments must be an integer >= 1"), 400
+    with recorders_lock:
+        recorder = recorders.get(name)
+        if recorder is not None and recorder.running:
+            return jsonify(status="error", message="already recording", recorder=recorder.status()), 409
+        try:
+            recorder = SegmentRecorder(cameras.camera(name), record_dir, name=name,
+                                       broadcaster=cameras.broadcaster(name),
+                                       source=data.get('source', 'auto'),
+                                       codec=data.get('codec', 'MJPG'),
+                                       segment_seconds=max(1.0, float(data.get('segment_seconds', 60))),
+                                       keep_segments=keep_segments)
+        except (TypeError, ValueError) as e:
+            return jsonify(status="error", message=str(e)), 400
+        recorder.start()
+        recorders[name] = recorder
+    return jsonify(status="success", recorder=recorder.status())
+
+@app.route('/record/stop', methods=['POST'])
+def record_stop():
+    """Stops recording a camera (JSON body: camera, default: the first one) and closes the current segment."""
+    data = request.get_json(silent=True) or {}
+    name = data.get('camera') or cameras.default
+    with recorders_lock:
+        recorder = recorders.get(name)
+        if recorder is None:
+            return jsonify(status="error", message=f"camera '{name}' is not recording"), 404
+        recorder.stop()
+    return jsonify(status="success", recorder=recorder.status())
+
+@app.route('/record/status')
+def record_status():
+    """Returns each recorder's state, current segment, finished segments and written/dropped frame counts."""
+    with recorders_lock:
+        return jsonify({name: recorder.status() for name, recorder in recorders.items()})
 
 # --- API Routes for Control ---
 @app.route('/control', methods=['POST'])
@@ -179,6 +292,16 @@ def update_speed():
 
     return jsonify(rpm=rpm, fps=fps)
 
+@app.route('/command_stats')
+def command_stats():
+    """Returns how many motor and servo frames the shared command scheduler kept off the serial link."""
+    return jsonify(scheduler.stats())
+
+@app.route('/link_stats')
+def link_stats():
+    """Returns serial link counters: bytes and frames each way, CRC errors, drops and write latency."""
+    return jsonify(board.stats())
+
 # --- Main Execution ---
 if __name__ == '__main__':
     try:
@@ -194,5 +317,7 @@ if __name__ == '__main__':
         # Ensure cleanup is performed
         mechanum.stop()
         lampControl.lampOff()
-        my_camera.camera_close()
+        for recorder in recorders.values():
+            recorder.stop()
+        cameras.close_all()  # also stops capture processes and frees their shared memory
         print("Robot shutdown complete.")
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# encoding:utf-8
+# 摄像头画面处理性能测试, 不需要连接摄像头
+# 对比旧的 resize(INTER_NEAREST) + 浮点映射表 remap 与一次定点映射表 remap 的每帧耗时
+# 以及映射表在有无磁盘缓存时的加载耗时, 采集路径使用预分配缓冲区前后的每帧内存分配和延迟
+# 和推流时每帧的处理耗时: YUYV 去畸变后编码, MJPEG 直通转发
+# 以及各 JPEG 编码后端在标定图像上按各画质预设的编码耗时和大小, 变化检测与编码一帧的耗时对比
+import time
+import tempfile
+import threading
+import tracemalloc
+import cv2
+import numpy as np
+from CameraCalibration.undistort_maps import build_undistort_maps, load_undistort_maps
+from CameraCalibration.CalibrationConfig import *
+from frame_ring import FrameRing
+from frame_broadcaster import ChangeDetector
+from jpeg_encoder import QUALITY_PRESETS, available_encoders, sample_images, benchmark as bench_encoder
+
+def load_calibration():
+    param_data = np.load(calibration_param_path + '.npz')
+    return param_data['mtx_array'], param_data['dist_array']
+
+def bench(func, number=50, repeat=5):
+    # 返回每次调用的最短耗时(ms)
+    func()
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter() - t0) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1000
+
+def bench_remap(mtx, dist, native_size, output_size):
+    frame = np.random.randint(0, 256, (native_size[1], native_size[0], 3), dtype=np.uint8)
+    frame = cv2.GaussianBlur(frame, (9, 9), 0)
+
+    newcameramtx, roi = cv2.getOptimalNewCameraMatrix(mtx, dist, output_size, 0, output_size)
+    mapx, mapy = cv2.initUndistortRectifyMap(mtx, dist, None, newcameramtx, output_size, cv2.CV_32FC1)
+    def two_pass():
+        frame_resize = cv2.resize(frame, output_size, interpolation=cv2.INTER_NEAREST)
+        return cv2.remap(frame_resize, mapx, mapy, cv2.INTER_LINEAR)
+
+    map1, map2 = build_undistort_maps(mtx, dist, native_size, output_size)
+    def fused():
+        return cv2.remap(frame, map1, map2, cv2.INTER_LINEAR)
+
+    # 两种方法输出的平均像素差, 用于确认结果一致
+    diff = np.mean(cv2.absdiff(two_pass(), fused()))
+    return bench(two_pass), bench(fused), diff
+
+def bench_map_loading(output_size=(640, 480)):
+    # 返回 (无缓存生成耗时 ms, 读取缓存耗时 ms)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        t0 = time.perf_counter()
+        load_undistort_maps(calibration_param_path + '.npz', output_size, output_size, cache_dir)
+        cold = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        load_undistort_maps(calibration_param_path + '.npz', output_size, output_size, cache_dir)
+        warm = time.perf_counter() - t0
+    return cold * 1000, warm * 1000
+
+def bench_capture_path(mtx, dist, native_size, output_size, frames=300):
+    # 模拟 cap.read: 不传入 image 时每次返回新数组, 传入时写入 image
+    source = np.random.randint(0, 256, (native_size[1], native_size[0], 3), dtype=np.uint8)
+    def read(image=None):
+        if image is None:
+            return True, source.copy()
+        np.copyto(image, source)
+        return True, image
+
+    map1, map2 = build_undistort_maps(mtx, dist, native_size, output_size)
+    def allocating():
+        ret, frame = read()
+        return cv2.remap(frame, map1, map2, cv2.INTER_LINEAR)
+
+    lock = threading.Condition()
+    ring = FrameRing(lock, (output_size[1], output_size[0], 3))
+    capture = [None]
+    def preallocated():
+        ret, capture[0] = read(capture[0])
+        with lock:
+            index = ring.acquire()
+        cv2.remap(capture[0], map1, map2, cv2.INTER_LINEAR, dst=ring.buffers[index])
+        with lock:
+            ring.latest = index
+            lock.notify_all()
+
+    # 两种方法交替运行, 避免测试机负载变化只影响其中一种
+    funcs = (allocating, preallocated)
+    times = ([], [])
+    for func in funcs:
+        func()
+    for _ in range(frames):
+        for func, samples in zip(funcs, times):
+            t0 = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - t0)
+    results = []
+    for func, samples in zip(funcs, times):
+        samples.sort()
+        tracemalloc.start()
+        func()
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        func()
+        peak = tracemalloc.get_traced_memory()[1] - current
+        tracemalloc.stop()
+        # (每帧临时分配 KB, p50 ms, p99 ms)
+        results.append((peak / 1024, samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.99)] * 1000))
+    return results
+
+def bench_streaming(mtx, dist, output_size):
+    # 返回 (去畸变 + 编码 ms, 直通转发 ms, 直通时按需解码 + 去畸变 ms)
+    frame = np.random.randint(0, 256, (output_size[1], output_size[0], 3), dtype=np.uint8)
+    frame = cv2.GaussianBlur(frame, (9, 9), 0)
+    jpeg = cv2.imencode('.jpg', frame)[1].tobytes()
+    map1, map2 = build_undistort_maps(mtx, dist, output_size, output_size)
+    dst = np.empty_like(frame)
+    def encode():
+        cv2.remap(frame, map1, map2, cv2.INTER_LINEAR, dst=dst)
+        return b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + cv2.imencode('.jpg', dst)[1].tobytes() + b'\r\n'
+    def passthrough():
+        return b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n'
+    def decode():
+        decoded = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+        cv2.remap(decoded, map1, map2, cv2.INTER_LINEAR, dst=dst)
+    return bench(encode), bench(passthrough), bench(decode)
+
+def bench_change_detector(output_size=(640, 480)):
+    # 返回 (变化检测 ms, 编码 ms), 画面静止时只需要做变化检测
+    frame = np.random.randint(0, 256, (output_size[1], output_size[0], 3), dtype=np.uint8)
+    frame = cv2.GaussianBlur(frame, (9, 9), 0)
+    detector = ChangeDetector(heartbeat=float('inf'))
+    detector.changed(0.0, frame)
+    return bench(lambda: detector.changed(1.0, frame)), bench(lambda: cv2.imencode('.jpg', frame))
+
+if __name__ == '__main__':
+    mtx, dist = load_calibration()
+    cases = [((640, 480), (640, 480)), ((1280, 720), (640, 480)), ((1280, 720), (1280, 720))]
+    print('%-22s %10s %10s %8s %8s' % ('capture -> output', 'before ms', 'after ms', 'speedup', 'diff'))
+    for native_size, output_size in cases:
+        before, after, diff = bench_remap(mtx, dist, native_size, output_size)
+        name = '%dx%d -> %dx%d' % (native_size + output_size)
+        print('%-22s %10.2f %10.2f %7.2fx %8.2f' % (name, before, after, before / after, diff))
+    cold, warm = bench_map_loading()
+    print('map loading: %.2f ms without cache, %.2f ms from cache' % (cold, warm))
+    print('%-22s %-14s %10s %8s %8s' % ('capture path', '', 'alloc KB', 'p50 ms', 'p99 ms'))
+    for native_size, output_size in cases:
+        name = '%dx%d -> %dx%d' % (native_size + output_size)
+        for label, (alloc, p50, p99) in zip(('allocating', 'preallocated'), bench_capture_path(mtx, dist, native_size, output_size)):
+            print('%-22s %-14s %10.0f %8.2f %8.2f' % (name, label, alloc, p50, p99))
+    for output_size in ((640, 480), (1280, 720)):
+        encode, passthrough, decode = bench_streaming(mtx, dist, output_size)
+        print('streaming %dx%d: undistort + encode %.2f ms, passthrough %.3f ms, on-demand decode + undistort %.2f ms'
+              % (output_size + (encode, passthrough, decode)))
+    detect, encode = bench_change_detector()
+    print('unchanged frame: change detection %.3f ms vs encode %.2f ms' % (detect, encode))
+    images = sample_images()
+    print('%-12s %-8s %8s %10s' % ('jpeg encoder', 'preset', 'ms', 'KB'))
+    for preset, (quality, subsampling) in QUALITY_PRESETS.items():
+        for encoder in available_encoders(quality, subsampling):
+            ms, size = bench_encoder(encoder, images)
+            print('%-12s %-8s %8.2f %10.1f' % (encoder.name, preset, ms, size / 1024))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# encoding:utf-8
+# 多摄像头管理: 枚举 V4L2 采集设备, 每个摄像头有独立的采集线程(或采集进程), 分辨率, 帧率, 标定参数和 JPEG 广播
+# USB 摄像头通常有两个节点(如 /dev/video0 采集, /dev/video1 元数据), 用 VIDIOC_QUERYCAP 只保留能采集画面的节点
+import os
+import glob
+import fcntl
+import struct
+from Camera import Camera
+from capture_worker import SharedCamera
+from frame_broadcaster import JpegBroadcaster
+from jpeg_encoder import select_encoder
+
+# struct v4l2_capability: driver[16], card[32], bus_info[32], version, capabilities, device_caps, reserved[3]
+v4l2_capability = struct.Struct('16s32s32sIII12x')
+VIDIOC_QUERYCAP = 0x80685600  # _IOR('V', 0, struct v4l2_capability)
+V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+V4L2_CAP_DEVICE_CAPS = 0x80000000
+
+def query_device(path):
+    # 返回 (卡名, 总线信息), 不是采集设备或无法打开时返回 None
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+    except OSError:
+        return None
+    try:
+        buf = fcntl.ioctl(fd, VIDIOC_QUERYCAP, bytes(v4l2_capability.size))
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    driver, card, bus_info, version, capabilities, device_caps = v4l2_capability.unpack(buf)
+    caps = device_caps if capabilities & V4L2_CAP_DEVICE_CAPS else capabilities
+    if not caps & V4L2_CAP_VIDEO_CAPTURE:
+        return None
+    return card.rstrip(b'\0').decode(errors='replace'), bus_info.rstrip(b'\0').decode(errors='replace')
+
+def enumerate_devices(usb_only=False):
+    # 返回 [(设备路径, 卡名, 总线信息)], 按设备序号排序
+    # 树莓派的 ISP 和编解码器节点也报告采集能力, usb_only 为 True 时只保留 USB 摄像头
+    devices = []
+    paths = glob.glob('/dev/video*')
+    paths.sort(key=lambda path: int(path[len('/dev/video'):]) if path[len('/dev/video'):].isdigit() else 1 << 30)
+    for path in paths:
+        info = query_device(path)
+        if info is not None and (not usb_only or info[1].startswith('usb')):
+            devices.append((path,) + info)
+    return devices
+
+class CameraManager:
+    # configs: [{'name': ..., 'device': ..., 'resolution': (w, h), 'fps': ..., 'passthrough': ..., 'worker': ..., 'calibration_path': ...}]
+    # 除 name 和 device 外都可以省略; configs 为 None 时为每个枚举到的 USB 摄像头创建 cam0, cam1, ...
+    # 一个设备都没有时创建一个自动选择设备的 cam0, 由采集监控在设备接入后连接
+    # change_threshold 和 heartbeat 传给每个 JpegBroadcaster, 画面没有变化时不编码
+    def __init__(self, configs=None, resolution=(640, 480), fps=30, passthrough=False, worker=False, encoder=None,
+                 change_threshold=None, heartbeat=2.0):
+        if configs is None:
+            configs = [{'name': 'cam%d' % i, 'device': path} for i, (path, card, bus_info) in enumerate(enumerate_devices(usb_only=True))]
+            if not configs:
+                configs = [{'name': 'cam0', 'device': None}]
+        # 所有摄像头共用一个编码后端, 只在启动时选择一次
+        self.encoder = select_encoder() if encoder is None else encoder
+        self.cameras = {}
+        self.broadcasters = {}
+        self.configs = {}
+        for config in configs:
+            config = dict({'resolution': resolution, 'fps': fps, 'passthrough': passthrough, 'worker': worker,
+                           'calibration_path': None}, **config)
+            name = config['name']
+            if name in self.cameras:
+                raise ValueError('摄像头名称重复: %s' % name)
+            if config['worker'] and config['passthrough']:
+                # 共享内存中传递的是解码后的画面, 采集进程不支持直通
+                raise ValueError('摄像头 %s: worker 与 passthrough 不能同时使用' % name)
+            if config['worker']:
+                camera = SharedCamera(config['resolution'], device=config['device'], fps=config['fps'],
+                                      calibration_path=config['calibration_path'])
+            else:
+                camera = Camera(config['resolution'], passthrough=config['passthrough'], device=config['device'],
+                                fps=config['fps'], calibration_path=config['calibration_path'])
+            self.cameras[name] = camera
+            self.broadcasters[name] = JpegBroadcaster(camera, encoder=self.encoder, change_threshold=change_threshold,
+                                                      heartbeat=heartbeat)
+            self.configs[name] = config
+
+    @property
+    def default(self):
+        # 第一个摄像头, 对应不带名称的 /video_feed
+        return next(iter(self.cameras))
+
+    def names(self):
+        return list(self.cameras)
+
+    def camera(self, name=None):
+        return self.cameras[self.default if name is None else name]
+
+    def broadcaster(self, name=None):
+        return self.broadcasters[self.default if name is None else name]
+
+    def open_all(self):
+        for camera in self.cameras.values():
+            camera.camera_open()
+
+    def close_all(self):
+        for camera in self.cameras.values():
+            camera.camera_close()
+            if isinstance(camera, SharedCamera):
+                camera.close()
+
+    def status(self):
+        status = {}
+        for name, camera in self.cameras.items():
+            status[name] = dict(camera.status(), device=self.configs[name]['device'])
+        return status
+
+if __name__ == '__main__':
+    for path, card, bus_info in enumerate_devices():
+        print(path, card, bus_info)
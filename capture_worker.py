@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# encoding:utf-8
+# 在独立进程中采集和去畸变, 画面写入共享内存中的缓冲区环, 不占用主进程的 GIL
+# 主进程通过 SharedCamera 以零拷贝方式读取, 接口与 Camera 相同, 可直接交给 JpegBroadcaster
+# 共享内存布局: 头部(最新序号, 采集时间, 最新缓冲区, 画面尺寸, 打开标志), 每个缓冲区的租用计数, 画面数据
+# 两个进程用共享内存文件上的 flock 互斥, 子进程每发布一帧向管道写一个字节唤醒主进程
+# 子进程用 subprocess 启动, 不会重新导入主进程的模块(app.py 在导入时就打开了串口和摄像头)
+import os
+import sys
+import json
+import time
+import fcntl
+import threading
+import subprocess
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from frame_ring import FrameLease
+
+header_dtype = np.dtype([('seq', '<i8'), ('timestamp', '<f8'), ('latest', '<i4'), ('opened', '<i4'),
+                         ('count', '<i4'), ('height', '<i4'), ('width', '<i4'), ('channels', '<i4'),
+                         ('state', '<i4'), ('reconnects', '<i4'), ('downtime', '<f8')])
+# 子进程中 Camera 的采集监控状态, 以序号写入头部
+camera_states = ('closed', 'streaming', 'reconnecting')
+
+class ProcessLock:
+    # 进程内用线程锁, 进程间用 flock, 两者都持有才算加锁
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.fd = os.open(path, os.O_RDONLY)
+
+    def acquire(self, blocking=True, timeout=-1):
+        if not self.lock.acquire(blocking, timeout):
+            return False
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return True
+
+    def release(self):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+    def close(self):
+        os.close(self.fd)
+
+class SharedFrameRing:
+    # 与 FrameRing 接口相同, 缓冲区数量固定, 所有方法都需要在 lock 内调用
+    def __init__(self, shape=None, count=4, name=None):
+        self.dtype = np.dtype(np.uint8)
+        if name is None:
+            self.shape = tuple(shape)
+            self.shm = shared_memory.SharedMemory(create=True, size=self.layout(count))
+            self.map(count)
+            self.header['seq'] = 0
+            self.header['latest'] = -1
+            self.header['opened'] = 0
+            self.header['state'] = 0
+            self.header['reconnects'] = 0
+            self.header['downtime'] = 0
+            self.header['count'] = count
+            self.header['height'], self.header['width'], self.header['channels'] = self.shape
+            self.leases[:] = 0
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # 只有创建者负责释放共享内存
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+            header = np.ndarray((), header_dtype, self.shm.buf)
+            self.shape = (int(header['height']), int(header['width']), int(header['channels']))
+            count = int(header['count'])
+            del header
+            self.layout(count)
+            self.map(count)
+            self.owner = False
+        self.name = self.shm.name
+        self.process_lock = ProcessLock('/dev/shm/' + self.shm._name.lstrip('/'))
+        self.lock = threading.Condition(self.process_lock)
+
+    def layout(self, count):
+        self.leases_offset = header_dtype.itemsize
+        # 画面数据按 64 字节对齐
+        self.data_offset = (self.leases_offset + 4 * count + 63) // 64 * 64
+        self.frame_size = int(np.prod(self.shape))
+        return self.data_offset + self.frame_size * count
+
+    def map(self, count):
+        buf = self.shm.buf
+        self.header = np.ndarray((), header_dtype, buf)
+        self.leases = np.ndarray((count,), '<i4', buf, self.leases_offset)
+        self.buffers = [np.ndarray(self.shape, self.dtype, buf, self.data_offset + i * self.frame_size)
+                        for i in range(count)]
+        self.views = []
+        for frame in self.buffers:
+            view = frame.view()
+            view.flags.writeable = False
+            self.views.append(view)
+
+    @property
+    def latest(self):
+        latest = int(self.header['latest'])
+        return None if latest < 0 else latest
+
+    @latest.setter
+    def latest(self, index):
+        self.header['latest'] = -1 if index is None else index
+
+    def acquire(self):
+        for index, leases in enumerate(self.leases):
+            if index != self.latest and leases == 0:
+                return index
+        return None
+
+    def lease(self, index, seq, timestamp):
+        self.leases[index] += 1
+        return FrameLease(self, index, seq, timestamp)
+
+    def close(self):
+        # 释放所有指向共享内存的 numpy 数组后才能关闭
+        self.header = self.leases = None
+        self.buffers = []
+        self.views = []
+        self.process_lock.close()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def capture_main(name, resolution, notify_fd, options):
+    # 子进程入口: 用 Camera 的采集循环写入共享内存, 主进程退出后随之退出
+    from Camera import Camera
+
+    class SharedMemoryCamera(Camera):
+        def acquire_buffer(self, frame):
+            if frame.shape[2:] != self.ring.shape[2:] or frame.dtype != self.ring.dtype:
+                print('画面格式与共享内存不一致:', frame.shape, frame.dtype)
+                return None
+            with self.frame_cond:
+                return self.ring.acquire()
+
+        def publish_buffer(self, index, timestamp):
+            with self.frame_cond:
+                self.ring.latest = index
+                self.frame = self.ring.views[index]
+                self.frame_seq += 1
+                self.frame_time = timestamp
+                self.ring.header['timestamp'] = timestamp
+                self.ring.header['seq'] = self.frame_seq
+            try:
+                os.write(notify_fd, b'\x01')
+            except BlockingIOError:
+                # 主进程还没读取之前的通知, 不影响唤醒
+                pass
+            except BrokenPipeError:
+                # 主进程已退出, 主循环随后结束
+                pass
+
+        def clear_frame(self):
+            with self.frame_cond:
+                self.frame = None
+                self.ring.latest = None
+
+    ring = SharedFrameRing(name=name)
+    os.set_blocking(notify_fd, False)
+    camera = SharedMemoryCamera(resolution, **options)
+    camera.frame_cond = ring.lock
+    camera.ring = ring
+    parent = os.getppid()
+    try:
+        while os.getppid() == parent:
+            opened = bool(ring.header['opened'])
+            if opened and not camera.opened:
+                camera.camera_open()
+            elif not opened and camera.opened:
+                camera.camera_close()
+            status = camera.status()
+            ring.header['state'] = camera_states.index(status['state'])
+            ring.header['reconnects'] = status['reconnects']
+            ring.header['downtime'] = status['downtime_s']
+            time.sleep(0.05)
+    finally:
+        camera.camera_close()
+
+class SharedCamera:
+    # 主进程中的摄像头接口, 采集在子进程中进行, device, fps 和 calibration_path 传给子进程中的 Camera
+    def __init__(self, resolution=(640, 480), count=4, device=None, fps=30, calibration_path=None):
+        self.width = resolution[0]
+        self.height = resolution[1]
+        self.device = device
+        options = {'device': device, 'fps': fps, 'calibration_path': calibration_path}
+        self.ring = SharedFrameRing((self.height, self.width, 3), count)
+        self.frame_cond = self.ring.lock
+        notify_read, notify_write = os.pipe()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), self.ring.name, str(self.width), str(self.height), str(notify_write),
+             json.dumps(options)],
+            pass_fds=(notify_write,), cwd=os.path.dirname(os.path.abspath(__file__)))
+        os.close(notify_write)
+        self.notify_fd = notify_read
+        self.th = threading.Thread(target=self.notify_task, daemon=True)
+        self.th.start()
+
+    def notify_task(self):
+        # 子进程每发布一帧写一个字节, 读到后唤醒等待画面的线程, 子进程退出时结束
+        while os.read(self.notify_fd, 4096):
+            with self.frame_cond:
+                self.frame_cond.notify_all()
+        print('采集进程已退出')
+
+    @property
+    def opened(self):
+        return bool(self.ring.header['opened'])
+
+    @property
+    def frame_seq(self):
+        return int(self.ring.header['seq'])
+
+    @property
+    def frame_time(self):
+        return float(self.ring.header['timestamp']) if self.frame_seq else None
+
+    @property
+    def frame(self):
+        latest = self.ring.latest
+        return None if latest is None else self.ring.views[latest]
+
+    def status(self):
+        header = self.ring.header
+        return {
+            'state': camera_states[int(header['state'])],
+            'reconnects': int(header['reconnects']),
+            'downtime_s': float(header['downtime']),
+            'frame_seq': self.frame_seq,
+            'worker_alive': self.process.poll() is None,
+        }
+
+    def camera_open(self):
+        self.ring.header['opened'] = 1
+
+    def camera_close(self):
+        self.ring.header['opened'] = 0
+
+    def lease_frame(self, after_seq=0, timeout=None):
+        # 与 Camera.lease_frame 相同, 画面直接指向共享内存
+        with self.frame_cond:
+            if not self.frame_cond.wait_for(lambda: self.ring.latest is not None and self.frame_seq > after_seq, timeout):
+                return None
+            return self.ring.lease(self.ring.latest, self.frame_seq, self.frame_time)
+
+    def wait_for_frame(self, after_seq=0, timeout=None):
+        lease = self.lease_frame(after_seq, timeout)
+        if lease is None:
+            return None
+        with lease:
+            return lease.seq, lease.timestamp, lease.frame.copy()
+
+    def close(self):
+        self.camera_close()
+        self.process.terminate()
+        self.process.wait()
+        self.th.join()
+        os.close(self.notify_fd)
+        self.ring.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) == 6:
+        # 由 SharedCamera 启动的采集进程
+        capture_main(sys.argv[1], (int(sys.argv[2]), int(sys.argv[3])), int(sys.argv[4]), json.loads(sys.argv[5]))
+        sys.exit(0)
+
+    camera = SharedCamera()
+    camera.camera_open()
+    seq = 0
+    t0 = time.monotonic()
+    for n in range(1, 301):
+        lease = camera.lease_frame(seq, timeout=5.0)
+        if lease is None:
+            print('没有收到画面')
+            break
+        with lease:
+            seq = lease.seq
+            latency = time.monotonic() - lease.timestamp
+        if n % 30 == 0:
+            print('%.1f fps, latency %.1f ms' % (n / (time.monotonic() - t0), latency * 1000))
+    camera.close()
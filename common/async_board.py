@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+# 基于 asyncio 的控制板接口, 串口挂在事件循环上收发, 舵机读取返回可等待对象
+# 多个读取可以同时发出, 应答按 (功能, 子命令, 舵机ID) 匹配, 支持超时和取消
+import asyncio
+import struct
+from common.ros_robot_controller_sdk import Board, PacketFunction, servo_cmd_struct
+
+# timeout 参数的默认值, 表示使用 AsyncBoard.reply_timeout; None 表示一直等待
+default_timeout = object()
+
+class AsyncBoard(Board):
+    def __init__(self, device=None, baudrate=1000000, reply_timeout=0.1):
+        self.loop = None
+        # 串口由事件循环在可读时读取, 不需要阻塞超时
+        # reply_timeout 为默认的应答超时(秒), None 表示一直等待
+        super().__init__(device, baudrate, timeout=0, reply_timeout=reply_timeout)
+
+    def start_recv(self):
+        # 不启动接收线程, 由 connect() 挂到事件循环上
+        pass
+
+    async def connect(self):
+        self.loop = asyncio.get_running_loop()
+        self.enable_recv = True
+        self.loop.add_reader(self.port.fileno(), self.on_readable)
+
+    def close(self):
+        if self.loop is not None:
+            self.loop.remove_reader(self.port.fileno())
+            self.loop = None
+        self.port.close()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    def on_readable(self):
+        recv_data = self.port.read(self.port.in_waiting or 1)
+        if recv_data and self.enable_recv:
+            self.packet_parser.feed(recv_data)
+
+    async def request(self, tx, func, cmd, servo_id, timeout=default_timeout):
+        # 发送读取指令并等待对应的应答, 超时抛出 asyncio.TimeoutError, 被取消时撤销等待
+        # 超时或取消后该请求的应答仍可能到达, 同一个键上的下一个请求等它到达或过了截止时间再发出
+        while True:
+            delay = self.late_reply_delay(func, cmd, servo_id)
+            if not delay:
+                break
+            # 应答由事件循环自己接收, 短暂让出即可
+            await asyncio.sleep(min(delay, 0.005))
+        future = self.loop.create_future()
+        def on_reply(data):
+            if not future.done():
+                future.set_result(data)
+        self.add_reply_waiter(func, cmd, servo_id, on_reply)
+        sent = False
+        try:
+            self.write_servo_cmd(tx, servo_cmd_struct, cmd, servo_id)
+            sent = True
+            return await asyncio.wait_for(future, self.reply_timeout if timeout is default_timeout else timeout)
+        finally:
+            self.remove_reply_waiter(func, cmd, servo_id, on_reply, late=sent)
+
+    async def pwm_servo_read_and_unpack(self, servo_id, cmd, unpack, timeout=default_timeout):
+        data = await self.request(self.tx_pwm_servo, PacketFunction.PACKET_FUNC_PWM_SERVO, cmd, servo_id, timeout)
+        servo_id, cmd, info = struct.unpack(unpack, data)
+        return info
+
+    async def bus_servo_read_and_unpack(self, servo_id, cmd, unpack, timeout=default_timeout):
+        data = await self.request(self.tx_bus_servo, PacketFunction.PACKET_FUNC_BUS_SERVO, cmd, servo_id, timeout)
+        servo_id, cmd, success, *info = struct.unpack(unpack, data)
+        if success == 0:
+            return info
+
+# 继承来的 bus_servo_read_* / pwm_servo_read_* 返回协程, 需要 await, 单次超时可用 asyncio.wait_for 指定
+
+async def main():
+    async with AsyncBoard() as board:
+        # 同时读取多个舵机的位置, 指令连续发出, 应答到达后分别返回
+        positions = await asyncio.gather(*(board.bus_servo_read_position(servo_id) for servo_id in (1, 2, 3)),
+                                         return_exceptions=True)
+        print('position:', positions)
+        print('pwm position:', await board.pwm_servo_read_position(1))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+# 控制板串口代理: 独占串口, 通过 Unix socket 供多个进程共用
+# socket 上直接传输原协议帧(0xAA 0x55 Function Length Data Checksum), 不再额外封装
+# 上报数据转发给所有客户端, 舵机读取的应答只发给发出该读取指令的客户端
+# 用法: python3 common/board_broker.py --device /dev/ttyAMA0
+#      其他进程设置 BOARD_DEVICE=unix:/tmp/ros_robot_controller.sock 或 Board(device='unix:...')
+import os
+import sys
+import time
+import fcntl
+import socket
+import struct
+import termios
+import argparse
+import selectors
+from collections import deque
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.ros_robot_controller_sdk import PacketFunction, PacketParser
+
+default_socket = '/tmp/ros_robot_controller.sock'
+
+# 会产生应答的舵机读取指令
+servo_read_cmds = {
+    PacketFunction.PACKET_FUNC_BUS_SERVO: {0x05, 0x07, 0x09, 0x0D, 0x12, 0x22, 0x32, 0x36, 0x3A},
+    PacketFunction.PACKET_FUNC_PWM_SERVO: {0x05, 0x09},
+}
+
+class SocketPort:
+    # 提供 Board 用到的 serial.Serial 接口, 连接到 broker 的 Unix socket
+    def __init__(self, path, timeout=None):
+        self.port = 'unix:' + path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.sock.settimeout(timeout)
+        self.is_open = True
+
+    @property
+    def in_waiting(self):
+        return struct.unpack('i', fcntl.ioctl(self.sock.fileno(), termios.FIONREAD, b'\0\0\0\0'))[0]
+
+    def read(self, size=1):
+        try:
+            data = self.sock.recv(size)
+        except (socket.timeout, BlockingIOError):
+            return b''
+        if not data:
+            raise ConnectionError('board broker closed the connection')
+        return data
+
+    def write(self, data):
+        self.sock.sendall(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.is_open = False
+        self.sock.close()
+
+class Client:
+    def __init__(self, broker, sock):
+        self.sock = sock
+        self.out = bytearray()  # 待发送的数据
+        self.parser = PacketParser({func: lambda frame, func=func: broker.forward(self, func, frame)
+                                    for func in PacketFunction if func != PacketFunction.PACKET_FUNC_NONE},
+                                   frames=True)
+
+class BoardBroker:
+    def __init__(self, device="/dev/ttyAMA0", path=default_socket, baudrate=1000000,
+                 max_backlog=65536, reply_timeout=1.0):
+        import serial
+        self.port = serial.Serial(None, baudrate, timeout=0)
+        self.port.rts = False
+        self.port.dtr = False
+        self.port.setPort(device)
+        self.port.open()
+
+        if os.path.exists(path):
+            os.unlink(path)
+        self.path = path
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen()
+        self.server.setblocking(False)
+
+        self.max_backlog = max_backlog  # 客户端未读取的数据超过该字节数时断开, 避免拖慢其他客户端
+        self.reply_timeout = reply_timeout  # 超过该时间(秒)未收到应答的读取请求不再等待
+        self.clients = []
+        self.pending = {}  # (功能, 子命令, 舵机ID) -> deque[(截止时间, 客户端)]
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.server, selectors.EVENT_READ, self.accept)
+        self.selector.register(self.port.fileno(), selectors.EVENT_READ, self.read_port)
+        self.port_parser = PacketParser({func: lambda frame, func=func: self.dispatch(func, frame)
+                                         for func in PacketFunction if func != PacketFunction.PACKET_FUNC_NONE},
+                                        frames=True)
+        self.frames_in = 0
+        self.frames_out = 0
+        self.unmatched_replies = 0  # 找不到读取请求而丢弃的舵机应答
+        self.next_expiry = 0  # 下一次清理超时请求的时间
+
+    def serve_forever(self):
+        try:
+            while True:
+                # 定时清理超时的读取请求, 一直没有应答的舵机不会让 pending 越积越多
+                for key, events in self.selector.select(self.reply_timeout):
+                    key.data(key.fileobj, events)
+                self.expire_pending()
+        finally:
+            self.close()
+
+    def close(self):
+        for client in list(self.clients):
+            self.drop(client)
+        self.selector.close()
+        self.server.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.port.close()
+
+    def accept(self, server, events):
+        sock, _ = server.accept()
+        sock.setblocking(False)
+        client = Client(self, sock)
+        self.clients.append(client)
+        self.selector.register(sock, selectors.EVENT_READ, lambda sock, events: self.service(client, events))
+
+    def drop(self, client):
+        if client in self.clients:
+            self.clients.remove(client)
+            self.selector.unregister(client.sock)
+            client.sock.close()
+            for key, waiting in list(self.pending.items()):
+                waiting = deque(entry for entry in waiting if entry[1] is not client)
+                if waiting:
+                    self.pending[key] = waiting
+                else:
+                    del self.pending[key]
+
+    def expire_pending(self):
+        now = time.monotonic()
+        if now < self.next_expiry:
+            return
+        self.next_expiry = now + self.reply_timeout
+        for key, waiting in list(self.pending.items()):
+            # 同一个键上的请求按发出顺序排列, 截止时间也是递增的
+            while waiting and waiting[0][0] < now:
+                waiting.popleft()
+            if not waiting:
+                del self.pending[key]
+
+    def service(self, client, events):
+        if events & selectors.EVENT_WRITE:
+            self.flush(client)
+            if client not in self.clients:
+                # 发送时发现连接已断开, socket 已关闭
+                return
+        if events & selectors.EVENT_READ:
+            try:
+                data = client.sock.recv(4096)
+            except BlockingIOError:
+                return
+            except ConnectionError:
+                self.drop(client)
+                return
+            if data:
+                client.parser.feed(data)
+            else:
+                self.drop(client)
+
+    def forward(self, client, func, frame):
+        # 客户端发来的指令原样写入串口, 读取指令记录下来, 以便把应答发回该客户端
+        if func in servo_read_cmds and len(frame) == 7 and frame[4] in servo_read_cmds[func]:
+            key = (func, frame[4], frame[5])
+            self.pending.setdefault(key, deque()).append((time.monotonic() + self.reply_timeout, client))
+        self.port.write(frame)
+        self.frames_out += 1
+
+    def read_port(self, fileno, events):
+        data = self.port.read(self.port.in_waiting or 1)
+        if data:
+            self.port_parser.feed(data)
+
+    def dispatch(self, func, frame):
+        self.frames_in += 1
+        frame = bytes(frame)
+        if func in servo_read_cmds and len(frame) >= 7:
+            # 应答为 [舵机ID, 子命令, ...], 广播读取 ID (254) 的应答按实际 ID 返回
+            client = self.take_pending((func, frame[5], frame[4])) or self.take_pending((func, frame[5], 254))
+            if client is not None:
+                self.send(client, frame)
+            else:
+                # 请求已超时或发出请求的客户端已断开, 广播出去会被其他客户端当作自己读取的结果
+                self.unmatched_replies += 1
+            return
+        for client in list(self.clients):
+            self.send(client, frame)
+
+    def take_pending(self, key):
+        waiting = self.pending.get(key)
+        now = time.monotonic()
+        while waiting:
+            deadline, client = waiting.popleft()
+            if deadline >= now and client in self.clients:
+                if not waiting:
+                    del self.pending[key]
+                return client
+        self.pending.pop(key, None)
+        return None
+
+    def send(self, client, frame):
+        if client.out:
+            client.out += frame
+            if len(client.out) > self.max_backlog:
+                print('客户端读取过慢, 断开连接')
+                self.drop(client)
+            return
+        try:
+            sent = client.sock.send(frame)
+        except BlockingIOError:
+            sent = 0
+        except ConnectionError:
+            self.drop(client)
+            return
+        if sent < len(frame):
+            client.out += frame[sent:]
+            self.selector.modify(client.sock, selectors.EVENT_READ | selectors.EVENT_WRITE,
+                                 lambda sock, events: self.service(client, events))
+
+    def flush(self, client):
+        try:
+            sent = client.sock.send(client.out)
+        except BlockingIOError:
+            return
+        except ConnectionError:
+            self.drop(client)
+            return
+        del client.out[:sent]
+        if not client.out:
+            self.selector.modify(client.sock, selectors.EVENT_READ,
+                                 lambda sock, events: self.service(client, events))
+
+def main():
+    parser = argparse.ArgumentParser(description='控制板串口代理')
+    parser.add_argument('--device', default=os.environ.get('BOARD_DEVICE', "/dev/ttyAMA0"))
+    parser.add_argument('--socket', default=default_socket)
+    parser.add_argument('--baudrate', type=int, default=1000000)
+    args = parser.parse_args()
+    if args.device.startswith('unix:'):
+        parser.error('--device 必须是串口')
+    broker = BoardBroker(args.device, args.socket, args.baudrate)
+    print('BOARD_DEVICE=unix:%s' % args.socket, flush=True)
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
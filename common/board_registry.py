@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+# 进程内共用的控制板实例, 同一个串口只打开一次, 只有一个接收线程
+# 各模块用 get_board() 代替 Board(), 用 get_scheduler() 共用同一个指令调度器
+import threading
+from common.ros_robot_controller_sdk import Board
+from common.command_scheduler import CommandScheduler
+
+lock = threading.Lock()
+boards = {}  # 串口 -> Board
+schedulers = {}  # 串口 -> CommandScheduler
+
+def get_board(device=None, **kwargs):
+    # 首次调用时创建, kwargs 只在创建时生效
+    device = device or Board.default_device
+    with lock:
+        board = boards.get(device)
+        if board is None:
+            board = boards[device] = Board(device, **kwargs)
+        return board
+
+def get_scheduler(device=None):
+    device = device or Board.default_device
+    board = get_board(device)
+    with lock:
+        scheduler = schedulers.get(device)
+        if scheduler is None:
+            scheduler = schedulers[device] = CommandScheduler(board)
+        return scheduler
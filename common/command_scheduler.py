@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+# 控制指令调度: 丢弃与上次发送值相同的电机/PWM舵机/RGB指令, 合并同一周期内的指令
+# 只跟踪经过调度器发送的指令, 直接调用 Board 修改过的通道需要先调用 invalidate()
+import time
+import threading
+from contextlib import contextmanager
+
+class CommandScheduler:
+    def __init__(self, board, keepalive=1.0):
+        self.board = board
+        self.keepalive = keepalive  # 电机指令保活间隔(秒), 防止下位机超时停机
+        self.lock = threading.RLock()
+        self.depth = 0
+
+        self.motor_sent = {}  # 电机 1-4 -> 占空比
+        self.motor_pending = {}
+        self.motor_time = 0
+        self.pwm_sent = {}  # PWM 舵机 1-6 -> 位置
+        self.pwm_pending = {}
+        self.pwm_duration = None
+        self.rgb_sent = {}  # 灯珠序号 -> (r, g, b)
+        self.rgb_pending = {}
+
+        self.requested = 0  # 调用方请求的指令帧数
+        self.sent = 0  # 实际发送的帧数, 包含保活帧
+        self.keepalives = 0
+
+    @contextmanager
+    def tick(self):
+        # 周期内的所有指令在退出时合并发送
+        with self.lock:
+            self.depth += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.flush()
+
+    def set_motor_duty(self, dutys):
+        with self.lock:
+            self.requested += 1
+            for motor_id, duty in dutys:
+                self.motor_pending[motor_id] = duty
+            if self.depth == 0:
+                self.flush()
+
+    def pwm_servo_set_position(self, duration, positions):
+        with self.lock:
+            self.requested += 1
+            if self.pwm_pending and duration != self.pwm_duration:
+                # 同一帧只能带一个运动时间, 时间不同时先把已有的发出去
+                self.flush_pwm_servo()
+            self.pwm_duration = duration
+            for servo_id, position in positions:
+                self.pwm_pending[servo_id] = position
+            if self.depth == 0:
+                self.flush()
+
+    def set_rgb(self, pixels):
+        with self.lock:
+            self.requested += 1
+            for index, r, g, b in pixels:
+                self.rgb_pending[index] = (r, g, b)
+            if self.depth == 0:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            self.flush_motor()
+            self.flush_pwm_servo()
+            self.flush_rgb()
+
+    def flush_motor(self):
+        changed = [[motor_id, duty] for motor_id, duty in self.motor_pending.items()
+                   if self.motor_sent.get(motor_id) != duty]
+        self.motor_pending.clear()
+        now = time.monotonic()
+        if changed:
+            self.board.set_motor_duty(changed)
+            for motor_id, duty in changed:
+                self.motor_sent[motor_id] = duty
+        elif self.motor_sent and now - self.motor_time >= self.keepalive:
+            self.board.set_motor_duty([[motor_id, duty] for motor_id, duty in self.motor_sent.items()])
+            self.keepalives += 1
+        else:
+            return
+        self.motor_time = now
+        self.sent += 1
+
+    def flush_pwm_servo(self):
+        changed = [[servo_id, position] for servo_id, position in self.pwm_pending.items()
+                   if self.pwm_sent.get(servo_id) != position]
+        self.pwm_pending.clear()
+        if changed:
+            self.board.pwm_servo_set_position(self.pwm_duration, changed)
+            for servo_id, position in changed:
+                self.pwm_sent[servo_id] = position
+            self.sent += 1
+
+    def flush_rgb(self):
+        changed = [[index, *color] for index, color in self.rgb_pending.items()
+                   if self.rgb_sent.get(index) != color]
+        self.rgb_pending.clear()
+        if changed:
+            self.board.set_rgb(changed)
+            for index, *color in changed:
+                self.rgb_sent[index] = tuple(color)
+            self.sent += 1
+
+    def invalidate(self):
+        # 忘记已发送的值, 下一条指令一定会发出
+        with self.lock:
+            self.motor_sent.clear()
+            self.pwm_sent.clear()
+            self.rgb_sent.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requested': self.requested,
+                'sent': self.sent,
+                'keepalives': self.keepalives,
+                'saved': self.requested - (self.sent - self.keepalives),
+            }
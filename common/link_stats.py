@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+# 串口链路统计用的直方图, 记录一次只做几次整数运算, 可以一直开着
+# 区间按 2 的幂划分, 第 i 个区间为 [2^(i-1), 2^i), 第 0 个区间为 0
+
+class Histogram:
+    def __init__(self, buckets=24):
+        self.counts = [0] * buckets
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        # value 为非负整数, 例如微秒数
+        index = value.bit_length()
+        counts = self.counts
+        if index >= len(counts):
+            index = len(counts) - 1
+        counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        # 把另一个区间数相同的直方图累加进来
+        for index, n in enumerate(other.counts):
+            self.counts[index] += n
+        self.count += other.count
+        self.total += other.total
+        if other.max > self.max:
+            self.max = other.max
+
+    def percentile(self, p):
+        # 返回第 p 百分位所在区间的上界, 没有数据时返回 0
+        if self.count == 0:
+            return 0
+        target = self.count * p / 100
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(1 << index, self.max) if index else 0
+        return self.max
+
+    def snapshot(self):
+        counts = list(self.counts)
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            # 区间上界 -> 次数, 只列出非空区间
+            'buckets': {(1 << index) if index else 0: n for index, n in enumerate(counts) if n},
+        }
@@ -2,8 +2,9 @@
 # coding=utf8
 import sys
 import math
-from common.ros_robot_controller_sdk import Board
-board = Board()
+from common.board_registry import get_board, get_scheduler
+board = get_board()
+scheduler = get_scheduler()
 
 class MecanumChassis:
     # A = 67  # mm
@@ -19,7 +20,7 @@ class MecanumChassis:
         self.angular_rate = 0
 
     def reset_motors(self):
-        board.set_motor_duty([[1, 0], [2, 0], [3, 0], [4, 0]])
+        scheduler.set_motor_duty([[1, 0], [2, 0], [3, 0], [4, 0]])
             
         self.velocity = 0
         self.direction = 0
@@ -47,7 +48,7 @@ class MecanumChassis:
         v4 = int(vy + vx + vp)
         if fake:
             return
-        board.set_motor_duty([[1, -v1], [2, v2], [3, -v3], [4, v4]])
+        scheduler.set_motor_duty([[1, -v1], [2, v2], [3, -v3], [4, v4]])
         self.velocity = velocity
         self.direction = direction
         self.angular_rate = angular_rate
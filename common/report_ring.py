@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+# 控制板上报数据的环形缓冲区
+# 存储空间预先分配, 每条记录带 time.monotonic() 时间戳, 读取不会取走数据, 可以有多个读者
+# 只允许一个写者(接收线程), 读者通过记录序号判断数据是否在读取期间被覆盖
+import time
+import numpy as np
+
+class ReportRing:
+    def __init__(self, dtype, capacity=256, max_age=1.0):
+        self.dtype = np.dtype(dtype)
+        self.size = self.dtype.itemsize
+        self.capacity = capacity
+        self.max_age = max_age  # 超过该时间(秒)的最新数据视为过期, 不再返回
+        self.data = np.zeros(capacity, dtype=self.dtype)
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.raw = memoryview(self.data.view(np.uint8).reshape(-1))
+        self.count = 0  # 已写入的总条数, 第 n 条记录的序号为 n
+
+    def push(self, payload, timestamp=None):
+        # payload 长度必须与 dtype 一致, 否则丢弃, 返回是否写入
+        if len(payload) != self.size:
+            return False
+        index = self.count % self.capacity
+        start = index * self.size
+        self.raw[start:start + self.size] = payload
+        self.times[index] = time.monotonic() if timestamp is None else timestamp
+        self.count += 1
+        return True
+
+    def latest(self, max_age=None):
+        # 返回 (序号, 时间戳, 原始字节), 没有数据或已过期时返回 None
+        while True:
+            seq = self.count
+            if seq == 0:
+                return None
+            index = (seq - 1) % self.capacity
+            timestamp = self.times[index]
+            start = index * self.size
+            payload = bytes(self.raw[start:start + self.size])
+            if self.count - seq < self.capacity - 1:
+                break
+        if time.monotonic() - timestamp > (self.max_age if max_age is None else max_age):
+            return None
+        return seq, timestamp, payload
+
+    def since(self, seq):
+        # 返回序号大于 seq 的全部记录 [(序号, 时间戳, 原始字节)], 已被覆盖的记录跳过
+        end = self.count
+        first = max(seq, end - self.capacity + 1)
+        records = []
+        for n in range(first + 1, end + 1):
+            index = (n - 1) % self.capacity
+            start = index * self.size
+            records.append((n, self.times[index], bytes(self.raw[start:start + self.size])))
+        overwritten = self.count + 1 - self.capacity - first
+        if overwritten > 0:
+            del records[:overwritten]
+        return records
+
+    def window(self, seconds):
+        # 返回最近 seconds 秒内的 (时间戳数组, 数据数组), 按时间先后排列, 数组为拷贝
+        end = self.count
+        k = min(end, self.capacity)
+        indices = np.arange(end - k, end) % self.capacity
+        times = self.times[indices]
+        data = self.data[indices]
+        overwritten = self.count + 1 - self.capacity - (end - k)
+        if overwritten > 0:
+            times = times[overwritten:]
+            data = data[overwritten:]
+        first = np.searchsorted(times, time.monotonic() - seconds)
+        return times[first:], data[first:]
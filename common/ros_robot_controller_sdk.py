@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 # encoding: utf-8
 # stm32 python sdk
+import os
 import enum
 import time
 import copy
-import queue
 import struct
 import serial
 import threading
+import numpy as np
+from common.report_ring import ReportRing
+from common.link_stats import Histogram
 
 class PacketControllerState(enum.IntEnum):
     # 通信协议的格式
@@ -66,13 +69,143 @@ crc8_table = [
     116, 42, 200, 150, 21, 75, 169, 247, 182, 232, 10, 84, 215, 137, 107, 53
 ]
 
-def checksum_crc8(data):
+# 预编译的数据格式, 配合 pack_into 直接写入发送缓冲区
+cmd_count_struct = struct.Struct("<BB")
+led_struct = struct.Struct("<BHHH")
+buzzer_struct = struct.Struct("<HHHH")
+motor_struct = struct.Struct("<Bf")
+rgb_struct = struct.Struct("<BBBB")
+servo_move_struct = struct.Struct("<BHB")
+servo_position_struct = struct.Struct("<BH")
+servo_cmd_struct = struct.Struct("<BB")
+servo_set_id_struct = struct.Struct("<BBB")
+servo_offset_struct = struct.Struct("<BBb")
+servo_limit_struct = struct.Struct("<BBHH")
+
+# 总线舵机状态字段: 子命令, 应答格式(舵机ID, 子命令, 结果, 数值), numpy 类型, 读取失败时的标记值
+servo_state_fields = {
+    'position': (0x05, struct.Struct("<BBbh"), 'i2', -32768),
+    'vin': (0x07, struct.Struct("<BBbH"), 'u2', 0xFFFF),
+    'temp': (0x09, struct.Struct("<BBbB"), 'u1', 0xFF),
+    'offset': (0x22, struct.Struct("<BBbb"), 'i1', -128),
+    'temp_limit': (0x3A, struct.Struct("<BBbB"), 'u1', 0xFF),
+    'torque_state': (0x0D, struct.Struct("<BBbb"), 'i1', -128),
+}
+
+def checksum_crc8(data, table=crc8_table):
     # 校验
     check = 0
     for b in data:
-        check = crc8_table[check ^ b]
+        check = table[check ^ b]
     return check & 0x00FF
 
+class PacketParser:
+    # 按块解析串口数据, 帧格式为 0xAA 0x55 Function Length Data Checksum
+    # 数据负载以 memoryview 的形式交给 parsers, 只在回调期间有效, 需要保留时请自行拷贝
+    # frames 为 True 时交给 parsers 的是包含帧头和校验的整帧, 用于原样转发
+    HEADER = b'\xaa\x55'
+
+    def __init__(self, parsers, frames=False):
+        self.parsers = parsers
+        self.frames = frames
+        self.buf = bytearray()
+
+        # 链路统计, 只在解析线程中修改
+        self.bytes_in = 0
+        self.frame_bytes = 0  # 校验通过的帧的总字节数, 其余字节都被丢弃
+        self.frame_counts = [0] * PacketFunction.PACKET_FUNC_NONE  # 各功能收到的帧数
+        self.crc_errors = 0
+        self.resyncs = 0  # 丢弃数据重新寻找帧头的次数
+
+    def feed(self, data):
+        buf = self.buf
+        buf += data
+        self.bytes_in += len(data)
+        consumed = self.parse(buf)
+        if consumed:
+            del buf[:consumed]
+
+    def parse(self, buf):
+        # 解析缓冲区中所有完整的帧, 返回已处理的字节数, 未完整的帧留在缓冲区等待后续数据
+        parsers = self.parsers
+        frames = self.frames
+        frame_counts = self.frame_counts
+        size = len(buf)
+        pos = 0
+        with memoryview(buf) as view:
+            while True:
+                start = buf.find(self.HEADER, pos)
+                if start < 0:
+                    # 末尾连续的 0xAA 可能属于下一帧帧头, 保留下来等待后续数据
+                    tail = size
+                    while tail > pos and buf[tail - 1] == 0xAA:
+                        tail -= 1
+                    if tail > pos:
+                        self.resyncs += 1
+                    return tail
+                # 与逐字节解析保持一致: 连续的 0xAA 两两配对, 帧头前有偶数个 0xAA 时不算帧头
+                run = start
+                while run > pos and buf[run - 1] == 0xAA:
+                    run -= 1
+                if (start - run) & 1:
+                    pos = start + 2
+                    continue
+                if start > pos:
+                    self.resyncs += 1
+                if start + 4 > size:
+                    return start
+                func = buf[start + 2]
+                if func >= PacketFunction.PACKET_FUNC_NONE:
+                    self.resyncs += 1
+                    pos = start + 3
+                    continue
+                end = start + 5 + buf[start + 3]
+                if end > size:
+                    return start
+                if checksum_crc8(view[start + 2:end - 1]) == buf[end - 1]:
+                    frame_counts[func] += 1
+                    self.frame_bytes += end - start
+                    parser = parsers.get(func)
+                    if parser is None:
+                        pass
+                    elif frames:
+                        parser(view[start:end])
+                    else:
+                        parser(view[start + 4:end - 1])
+                else:
+                    self.crc_errors += 1
+                    self.resyncs += 1
+                    print("校验失败")
+                pos = end
+
+class FrameBuffer:
+    # 单个功能的发送缓冲区, 帧头和功能码预先填好, 数据用 pack_into 直接写到偏移 4 处
+    def __init__(self, func):
+        self.buf = bytearray(5 + 255)
+        self.buf[0:3] = (0xAA, 0x55, int(func))
+        self.view = memoryview(self.buf)
+        self.slices = {}
+
+    def frame(self, length):
+        # 填写长度并在缓冲区内计算校验, 返回整帧的 memoryview, 各长度的切片只创建一次
+        slices = self.slices.get(length)
+        if slices is None:
+            end = 4 + length
+            slices = self.slices[length] = (self.view[2:end], self.view[:end + 1])
+        buf = self.buf
+        buf[3] = length
+        buf[4 + length] = checksum_crc8(slices[0])
+        return slices[1]
+
+class Subscription:
+    # 上报数据的订阅, rate 为最高回调频率(Hz), None 表示每一帧都回调
+    def __init__(self, func, callback, rate=None, executor=None):
+        self.func = int(func)
+        self.callback = callback
+        self.interval = 1.0 / rate if rate else 0
+        self.executor = executor
+        self.last_time = None
+
 class SBusStatus:
     def __init__(self):
         self.channels = [0] * 16;
@@ -97,28 +230,92 @@ class Board:
             'GAMEPAD_BUTTON_MASK_R1':        0x8000
     }
 
-    def __init__(self, device="/dev/ttyAMA0", baudrate=1000000, timeout=5):
+    # 各类上报数据在环形缓冲区中的存储格式
+    imu_dtype = np.dtype(('<f4', (6,)))  # ax, ay, az, gx, gy, gz
+    gamepad_dtype = np.dtype([('buttons', '<u2'), ('hat', 'u1'), ('lx', 'i1'), ('ly', 'i1'), ('rx', 'i1'), ('ry', 'i1')])
+    sbus_dtype = np.dtype([('channels', '<i2', (16,)), ('channel_17', 'u1'), ('channel_18', 'u1'),
+                           ('signal_loss', 'u1'), ('fail_safe', 'u1')])
+    battery_dtype = np.dtype('<u2')  # mV
+    key_dtype = np.dtype([('key_id', 'u1'), ('event', 'u1')])
+
+    # 默认串口可由环境变量 BOARD_DEVICE 指定, 例如指向 virtual_board.py 创建的伪终端
+    default_device = os.environ.get('BOARD_DEVICE', "/dev/ttyAMA0")
+
+    def __init__(self, device=None, baudrate=1000000, timeout=5, report_max_age=1.0, executor=None, reply_timeout=1.0):
+        if device is None:
+            device = self.default_device
         self.enable_recv = False
-        self.frame = []
-        self.recv_count = 0
 
-        self.port = serial.Serial(None, baudrate, timeout=timeout)
-        self.port.rts = False
-        self.port.dtr = False
-        self.port.setPort(device)
-        self.port.open()
+        if device.startswith('unix:'):
+            # 通过 board_broker 与其他进程共用串口
+            from common.board_broker import SocketPort
+            self.port = SocketPort(device[len('unix:'):], timeout=timeout)
+        else:
+            self.port = serial.Serial(None, baudrate, timeout=timeout)
+            self.port.rts = False
+            self.port.dtr = False
+            self.port.setPort(device)
+            self.port.open()
+
+        # 每种功能一块发送缓冲区, 由 tx_lock 保护
+        self.tx_lock = threading.Lock()
+        self.tx_buffers = {func: FrameBuffer(func) for func in PacketFunction}
+        self.tx_led = self.tx_buffers[PacketFunction.PACKET_FUNC_LED]
+        self.tx_buzzer = self.tx_buffers[PacketFunction.PACKET_FUNC_BUZZER]
+        self.tx_motor = self.tx_buffers[PacketFunction.PACKET_FUNC_MOTOR]
+        self.tx_pwm_servo = self.tx_buffers[PacketFunction.PACKET_FUNC_PWM_SERVO]
+        self.tx_bus_servo = self.tx_buffers[PacketFunction.PACKET_FUNC_BUS_SERVO]
+        self.tx_oled = self.tx_buffers[PacketFunction.PACKET_FUNC_OLED]
+        self.tx_rgb = self.tx_buffers[PacketFunction.PACKET_FUNC_RGB]
+
+        # 链路统计, 见 stats(), 发送相关的计数在 tx_lock 内修改
+        self.baudrate = baudrate
+        self.start_time = time.monotonic()
+        self.bytes_out = 0
+        self.frames_out = [0] * PacketFunction.PACKET_FUNC_NONE
+        self.write_latency = Histogram()  # port.write 耗时(us)
+        self.dropped_replies = 0  # 没有读取者而被丢弃的舵机应答
+        self.dropped_reports = 0  # 长度不对而被丢弃的上报
 
-        self.state = PacketControllerState.PACKET_CONTROLLER_STATE_STARTBYTE1
         self.servo_read_lock = threading.Lock()
         self.pwm_servo_read_lock = threading.Lock()
-        
-        self.sys_queue = queue.Queue(maxsize=1)
-        self.bus_servo_queue = queue.Queue(maxsize=1)
-        self.pwm_servo_queue = queue.Queue(maxsize=1)
-        self.key_queue = queue.Queue(maxsize=1)
-        self.imu_queue = queue.Queue(maxsize=1)
-        self.gamepad_queue = queue.Queue(maxsize=1)
-        self.sbus_queue = queue.Queue(maxsize=1)
+
+        # 舵机读取的应答按 (功能, 子命令, 舵机ID) 分发给等待者, 没有等待者的应答被丢弃
+        self.reply_timeout = reply_timeout  # bus_servo_read_* / pwm_servo_read_* 等待应答的时间(秒), None 表示一直等待
+        self.reply_lock = threading.Lock()
+        self.reply_cond = threading.Condition(self.reply_lock)
+        self.reply_waiters = {}
+        # 等待超时的请求: (功能, 子命令, 舵机ID) -> 截止时间, 截止前到达的一条应答视为迟到而丢弃
+        # 同一个键上的新请求要等应答到达或过了截止时间再发出, 否则无法区分两条请求的应答
+        self.late_replies = {}
+        self.late_reply_timeout = 0.2
+
+        # 上报数据只由接收线程写入, 读取不会取走数据, 超过 max_age 秒没有更新则不再返回
+        self.imu_ring = ReportRing(self.imu_dtype, max_age=report_max_age)
+        self.gamepad_ring = ReportRing(self.gamepad_dtype, max_age=report_max_age)
+        self.sbus_ring = ReportRing(self.sbus_dtype, max_age=report_max_age)
+        self.battery_ring = ReportRing(self.battery_dtype, capacity=64, max_age=max(report_max_age, 5.0))
+        self.key_ring = ReportRing(self.key_dtype, capacity=64, max_age=report_max_age)
+        self.report_rings = {
+            PacketFunction.PACKET_FUNC_SYS: self.battery_ring,
+            PacketFunction.PACKET_FUNC_KEY: self.key_ring,
+            PacketFunction.PACKET_FUNC_IMU: self.imu_ring,
+            PacketFunction.PACKET_FUNC_GAMEPAD: self.gamepad_ring,
+            PacketFunction.PACKET_FUNC_SBUS: self.sbus_ring,
+        }
+        self.key_seq = 0  # get_button 已返回的最后一个按键事件
+
+        # 订阅者列表在修改时整体替换, 接收线程读取时不需要加锁
+        self.executor = executor
+        self.subscriber_lock = threading.Lock()
+        self.subscribers = {}
+        self.decoders = {
+            PacketFunction.PACKET_FUNC_SYS: self.decode_battery,
+            PacketFunction.PACKET_FUNC_KEY: self.decode_key,
+            PacketFunction.PACKET_FUNC_IMU: self.decode_imu,
+            PacketFunction.PACKET_FUNC_GAMEPAD: self.decode_gamepad,
+            PacketFunction.PACKET_FUNC_SBUS: self.decode_sbus,
+        }
 
         self.parsers = {
             PacketFunction.PACKET_FUNC_SYS: self.packet_report_sys,
@@ -129,243 +326,477 @@ class Board:
             PacketFunction.PACKET_FUNC_SBUS: self.packet_report_sbus,
             PacketFunction.PACKET_FUNC_PWM_SERVO: self.packet_report_pwm_servo
         }
+        self.packet_parser = PacketParser(self.parsers)
 
+        self.start_recv()
+
+    def start_recv(self):
         threading.Thread(target=self.recv_task, daemon=True).start()
         time.sleep(0.1)
 
-    def packet_report_sys(self, data):
+    def add_reply_waiter(self, func, cmd, servo_id, callback):
+        # callback(data) 在接收线程中被调用, 同一个键上的等待者按先后顺序应答
+        # 发出请求前先用 late_reply_delay / wait_late_reply 确认该键上没有迟到的应答
+        with self.reply_lock:
+            self.purge_late_replies(time.monotonic())
+            self.reply_waiters.setdefault((int(func), cmd, servo_id), []).append(callback)
+
+    def remove_reply_waiter(self, func, cmd, servo_id, callback, late=False):
+        # 返回 False 表示应答已经交给 callback
+        # late 为 True 时请求已发出但没有等到应答, 之后 late_reply_timeout 秒内到达的一条应答会被丢弃
+        key = (int(func), cmd, servo_id)
+        with self.reply_lock:
+            now = time.monotonic()
+            self.purge_late_replies(now)
+            waiters = self.reply_waiters.get(key)
+            if waiters is None or callback not in waiters:
+                return False
+            waiters.remove(callback)
+            if not waiters:
+                del self.reply_waiters[key]
+            if late:
+                self.late_replies[key] = now + self.late_reply_timeout
+            return True
+
+    def purge_late_replies(self, now):
+        # 在 reply_lock 内调用, 去掉过了截止时间的记录, 一直没有应答的舵机不会让记录越积越多
+        for key in [key for key, deadline in self.late_replies.items() if deadline <= now]:
+            del self.late_replies[key]
+
+    def late_deadline(self, func, cmd, servo_id):
+        # 在 reply_lock 内调用, 该键(或广播ID 254)上可能还有迟到的应答时返回截止时间, 否则返回 0
+        return max(self.late_replies.get((int(func), cmd, servo_id), 0), self.late_replies.get((int(func), cmd, 254), 0))
+
+    def late_reply_delay(self, func, cmd, servo_id):
+        # 距该键上迟到应答的截止时间还有多少秒, 没有时返回 0
+        with self.reply_lock:
+            return max(0, self.late_deadline(func, cmd, servo_id) - time.monotonic())
+
+    def wait_late_reply(self, func, cmd, servo_id):
+        # 阻塞到该键上迟到的应答到达或过了截止时间
+        with self.reply_cond:
+            while True:
+                delay = self.late_deadline(func, cmd, servo_id) - time.monotonic()
+                if delay <= 0:
+                    return
+                self.reply_cond.wait(delay)
+
+    def dispatch_reply(self, func, data):
+        # 应答数据的前两个字节为舵机ID和子命令, 广播ID 254 的请求可以匹配任意舵机的应答
+        with self.reply_lock:
+            for key in ((int(func), data[1], data[0]), (int(func), data[1], 254)):
+                waiters = self.reply_waiters.get(key)
+                if waiters:
+                    callback = waiters.pop(0)
+                    if not waiters:
+                        del self.reply_waiters[key]
+                    break
+            else:
+                return self.discard_late_reply(func, data)
+        callback(bytes(data))
+        return True
+
+    def discard_late_reply(self, func, data):
+        # 在 reply_lock 内调用, 没有等待者的应答都被丢弃; 属于已超时的请求时唤醒等着发同样请求的线程
+        self.dropped_replies += 1
+        now = time.monotonic()
+        self.purge_late_replies(now)
+        for key in ((int(func), data[1], data[0]), (int(func), data[1], 254)):
+            if self.late_replies.pop(key, None) is not None:
+                self.reply_cond.notify_all()
+                break
+        return True
+
+    def subscribe(self, func, callback, rate=None, executor=None):
+        # 每帧上报在接收线程中只解码一次, 再分发给所有订阅者: callback(value, timestamp)
+        # value 与对应 get_* 的返回值相同, 按键为 (key_id, PacketReportKeyEvents), 电池为 mV
+        # 指定 executor(或创建 Board 时指定)后回调提交到 executor 执行, 不占用接收线程
+        if func not in self.decoders:
+            raise ValueError('unsupported report: %r' % (func,))
+        subscription = Subscription(func, callback, rate, executor or self.executor)
+        with self.subscriber_lock:
+            self.subscribers[subscription.func] = self.subscribers.get(subscription.func, []) + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.subscriber_lock:
+            subscribers = [s for s in self.subscribers.get(subscription.func, []) if s is not subscription]
+            if subscribers:
+                self.subscribers[subscription.func] = subscribers
+            else:
+                self.subscribers.pop(subscription.func, None)
+
+    def notify(self, func, data, timestamp):
+        subscribers = self.subscribers.get(func)
+        if not subscribers:
+            return
         try:
-            self.sys_queue.put_nowait(data)
-        except queue.Full:
-            pass
+            value = self.decoders[func](data)
+        except Exception as e:
+            print('上报数据解码失败:', e)
+            return
+        for subscription in subscribers:
+            if subscription.interval:
+                if subscription.last_time is not None and timestamp - subscription.last_time < subscription.interval:
+                    continue
+                subscription.last_time = timestamp
+            if subscription.executor is not None:
+                subscription.executor.submit(subscription.callback, value, timestamp)
+            else:
+                try:
+                    subscription.callback(value, timestamp)
+                except Exception as e:
+                    print('订阅回调出错:', e)
+
+    def packet_report_sys(self, data):
+        # 系统上报中只有子命令 0x04 (电池电压) 被使用
+        if not data or data[0] != 0x04:
+            return
+        if len(data) == 3:
+            timestamp = time.monotonic()
+            self.battery_ring.push(data[1:], timestamp)
+            if self.subscribers:
+                self.notify(PacketFunction.PACKET_FUNC_SYS, data[1:], timestamp)
+        else:
+            self.dropped_reports += 1
 
     def packet_report_key(self, data):
-        try:
-            self.key_queue.put_nowait(data)
-        except queue.Full:
-            pass
+        timestamp = time.monotonic()
+        if not self.key_ring.push(data, timestamp):
+            self.dropped_reports += 1
+        elif self.subscribers:
+            self.notify(PacketFunction.PACKET_FUNC_KEY, data, timestamp)
 
     def packet_report_imu(self, data):
-        try:
-            self.imu_queue.put_nowait(data)
-        except queue.Full:
-            pass
+        timestamp = time.monotonic()
+        if not self.imu_ring.push(data, timestamp):
+            self.dropped_reports += 1
+        elif self.subscribers:
+            self.notify(PacketFunction.PACKET_FUNC_IMU, data, timestamp)
 
     def packet_report_gamepad(self, data):
-        try:
-            self.gamepad_queue.put_nowait(data)
-        except queue.Full:
-            pass
+        timestamp = time.monotonic()
+        if not self.gamepad_ring.push(data, timestamp):
+            self.dropped_reports += 1
+        elif self.subscribers:
+            self.notify(PacketFunction.PACKET_FUNC_GAMEPAD, data, timestamp)
 
     def packet_report_serial_servo(self, data):
-        try:
-            self.bus_servo_queue.put_nowait(data)
-        except queue.Full:
-            pass
+        if len(data) >= 2:
+            self.dispatch_reply(PacketFunction.PACKET_FUNC_BUS_SERVO, data)
+        else:
+            self.dropped_replies += 1
 
     def packet_report_pwm_servo(self, data):
-        try:
-            self.pwm_servo_queue.put_nowait(data)
-        except queue.Full:
-            pass
+        if len(data) >= 2:
+            self.dispatch_reply(PacketFunction.PACKET_FUNC_PWM_SERVO, data)
+        else:
+            self.dropped_replies += 1
 
     def packet_report_sbus(self, data):
-        try:
-            self.sbus_queue.put_nowait(data)
-        except queue.Full:
-            pass
+        timestamp = time.monotonic()
+        if not self.sbus_ring.push(data, timestamp):
+            self.dropped_reports += 1
+        elif self.subscribers:
+            self.notify(PacketFunction.PACKET_FUNC_SBUS, data, timestamp)
 
-    def get_battery(self):
+    def get_battery(self, max_age=None):
         if self.enable_recv:
-            try:
-                data = self.sys_queue.get(block=False)
-                if data[0] == 0x04:
-                    return struct.unpack('<H', data[1:])[0]
-                else:
-                    None
-            except queue.Empty:
-                return None
+            report = self.battery_ring.latest(max_age)
+            if report is not None:
+                return self.decode_battery(report[2])
+            return None
         else:
             # print('enable reception first!')
             return None
 
     def get_button(self):
+        # 按键是事件, 每个事件只由 get_button 返回一次, 其他读者可以用 key_ring.since(seq) 自行跟踪
         if self.enable_recv:
-            try:
-                data = self.key_queue.get(block=False)
-                key_id = data[0]
-                key_event = PacketReportKeyEvents(data[1])
+            for seq, timestamp, data in self.key_ring.since(self.key_seq):
+                self.key_seq = seq
+                key_id, key_event = self.decode_key(data)
                 if key_event == PacketReportKeyEvents.KEY_EVENT_CLICK:
                     return key_id, 0
                 elif key_event == PacketReportKeyEvents.KEY_EVENT_PRESSED:
                     return key_id, 1
-            except queue.Empty:
-                return None
+            return None
         else:
             # print('enable reception first!')
             return None
 
-    def get_imu(self):
+    def get_imu(self, max_age=None):
         if self.enable_recv:
-            try:
-                # ax, ay, az, gx, gy, gz
-                return struct.unpack('<6f', self.imu_queue.get(block=False))
-            except queue.Empty:
-                return None
+            report = self.imu_ring.latest(max_age)
+            if report is not None:
+                return self.decode_imu(report[2])
+            return None
         else:
             # print('enable reception first!')
             return None
 
-    def get_gamepad(self):
+    def get_imu_window(self, seconds):
+        # 最近 seconds 秒内的 IMU 数据: (时间戳数组, N x 6 的 float32 数组)
+        return self.imu_ring.window(seconds)
+
+    def get_report_window(self, func, seconds):
+        # 最近 seconds 秒内某类上报的原始记录, 字段见 Board.*_dtype
+        return self.report_rings[func].window(seconds)
+
+    def get_gamepad(self, max_age=None):
         if self.enable_recv:
-            try:
-                # buttons, hat, lx, ly, rx, ry
-                gamepad_data = struct.unpack("<HB4b", self.gamepad_queue.get(block=False))
-                # 'lx', 'ly', 'rx', 'ry', 'r2', 'l2', 'hat_x', 'hat_y'
-                axes = [0, 0, 0, 0, 0, 0, 0, 0]
-                # 'cross', 'circle', '', 'square', 'triangle', '', 'l1', 'r1', 'l2', 'r2', 'select', 'start', '', 'l3', 'r3', ''
-                buttons = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0] 
-                for b in self.buttons_map:
-                    if self.buttons_map[b] & gamepad_data[0]:
-                        if b == 'GAMEPAD_BUTTON_MASK_R2':
-                            axes[4] = 1
-                        elif b == 'GAMEPAD_BUTTON_MASK_L2':
-                            axes[5] = 1
-                        elif b == 'GAMEPAD_BUTTON_MASK_CROSS':
-                            buttons[0] = 1
-                        elif b == 'GAMEPAD_BUTTON_MASK_CIRCLE':
-                            buttons[1] = 1
-                        elif b == 'GAMEPAD_BUTTON_MASK_SQUARE':
-                            buttons[3] = 1
-                        elif b == 'GAMEPAD_BUTTON_MASK_TRIANGLE':
-                            buttons[4] = 1
-                        elif b == 'GAMEPAD_BUTTON_MASK_L1':
-                            buttons[6] = 1
-                        elif b == 'GAMEPAD_BUTTON_MASK_R1':
-                            buttons[7] = 1
-                        elif b == 'GAMEPAD_BUTTON_MASK_SELECT':
-                            buttons[10] = 1
-                        elif b == 'GAMEPAD_BUTTON_MASK_START':
-                            buttons[11] = 1
-               
-                if gamepad_data[2] > 0:
-                    axes[0] = -gamepad_data[2] / 127
-                elif gamepad_data[2] < 0:
-                    axes[0] = -gamepad_data[2] / 128
-
-                if gamepad_data[3] > 0:
-                    axes[1] = gamepad_data[3] / 127
-                elif gamepad_data[3] < 0:
-                    axes[1] = gamepad_data[3] / 128
-
-                if gamepad_data[4] > 0:
-                    axes[2] = -gamepad_data[4] / 127
-                elif gamepad_data[4] < 0:
-                    axes[2] = -gamepad_data[4] / 128
-
-                if gamepad_data[5] > 0:
-                    axes[3] = gamepad_data[5] / 127
-                elif gamepad_data[5] < 0:
-                    axes[3] = gamepad_data[5] / 128
-            
-                if gamepad_data[1] == 9:
-                    axes[6] = 1
-                elif gamepad_data[1] == 13:
-                    axes[6] = -1
-                
-                if gamepad_data[1] == 11:
-                    axes[7] = -1
-                elif gamepad_data[1] == 15:
-                    axes[7] = 1
-                return axes, buttons
-            except queue.Empty:
-                return None
+            report = self.gamepad_ring.latest(max_age)
+            if report is not None:
+                return self.decode_gamepad(report[2])
+            return None
         else:
             # print('enable reception first!')
             return None
 
-    def get_sbus(self):
+    def get_sbus(self, max_age=None):
         if self.enable_recv:
-            try:
-                sbus_data = self.sbus_queue.get(block=False)
-                status = SBusStatus()
-                *status.channels, ch17, ch18, sig_loss, fail_safe = struct.unpack("<16hBBBB", sbus_data)
-                status.channel_17 = ch17 != 0
-                status.channel_18 = ch18 != 0
-                status.signal_loss = sig_loss != 0
-                status.fail_safe = fail_safe != 0
-                data = []
-                if status.signal_loss:
-                    data = 16 * [0.5]
-                    data[4] = 0
-                    data[5] = 0
-                    data[6] = 0
-                    data[7] = 0
-                else:
-                    for i in status.channels:
-                        data.append((i - 192)/(1792 - 192))
-                return data
-            except queue.Empty:
-                return None
+            report = self.sbus_ring.latest(max_age)
+            if report is not None:
+                return self.decode_sbus(report[2])
+            return None
         else:
             # print('enable reception first!')
             return None
 
+    def decode_battery(self, data):
+        return struct.unpack('<H', data)[0]
+
+    def decode_key(self, data):
+        return data[0], PacketReportKeyEvents(data[1])
+
+    def decode_imu(self, data):
+        # ax, ay, az, gx, gy, gz
+        return struct.unpack('<6f', data)
+
+    def decode_gamepad(self, data):
+        # buttons, hat, lx, ly, rx, ry
+        gamepad_data = struct.unpack("<HB4b", data)
+        # 'lx', 'ly', 'rx', 'ry', 'r2', 'l2', 'hat_x', 'hat_y'
+        axes = [0, 0, 0, 0, 0, 0, 0, 0]
+        # 'cross', 'circle', '', 'square', 'triangle', '', 'l1', 'r1', 'l2', 'r2', 'select', 'start', '', 'l3', 'r3', ''
+        buttons = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0] 
+        for b in self.buttons_map:
+            if self.buttons_map[b] & gamepad_data[0]:
+                if b == 'GAMEPAD_BUTTON_MASK_R2':
+                    axes[4] = 1
+                elif b == 'GAMEPAD_BUTTON_MASK_L2':
+                    axes[5] = 1
+                elif b == 'GAMEPAD_BUTTON_MASK_CROSS':
+                    buttons[0] = 1
+                elif b == 'GAMEPAD_BUTTON_MASK_CIRCLE':
+                    buttons[1] = 1
+                elif b == 'GAMEPAD_BUTTON_MASK_SQUARE':
+                    buttons[3] = 1
+                elif b == 'GAMEPAD_BUTTON_MASK_TRIANGLE':
+                    buttons[4] = 1
+                elif b == 'GAMEPAD_BUTTON_MASK_L1':
+                    buttons[6] = 1
+                elif b == 'GAMEPAD_BUTTON_MASK_R1':
+                    buttons[7] = 1
+                elif b == 'GAMEPAD_BUTTON_MASK_SELECT':
+                    buttons[10] = 1
+                elif b == 'GAMEPAD_BUTTON_MASK_START':
+                    buttons[11] = 1
+
+        if gamepad_data[2] > 0:
+            axes[0] = -gamepad_data[2] / 127
+        elif gamepad_data[2] < 0:
+            axes[0] = -gamepad_data[2] / 128
+
+        if gamepad_data[3] > 0:
+            axes[1] = gamepad_data[3] / 127
+        elif gamepad_data[3] < 0:
+            axes[1] = gamepad_data[3] / 128
+
+        if gamepad_data[4] > 0:
+            axes[2] = -gamepad_data[4] / 127
+        elif gamepad_data[4] < 0:
+            axes[2] = -gamepad_data[4] / 128
+
+        if gamepad_data[5] > 0:
+            axes[3] = gamepad_data[5] / 127
+        elif gamepad_data[5] < 0:
+            axes[3] = gamepad_data[5] / 128
+
+        if gamepad_data[1] == 9:
+            axes[6] = 1
+        elif gamepad_data[1] == 13:
+            axes[6] = -1
+
+        if gamepad_data[1] == 11:
+            axes[7] = -1
+        elif gamepad_data[1] == 15:
+            axes[7] = 1
+        return axes, buttons
+
+    def decode_sbus(self, data):
+        status = SBusStatus()
+        *status.channels, ch17, ch18, sig_loss, fail_safe = struct.unpack("<16hBBBB", data)
+        status.channel_17 = ch17 != 0
+        status.channel_18 = ch18 != 0
+        status.signal_loss = sig_loss != 0
+        status.fail_safe = fail_safe != 0
+        values = []
+        if status.signal_loss:
+            values = 16 * [0.5]
+            values[4] = 0
+            values[5] = 0
+            values[6] = 0
+            values[7] = 0
+        else:
+            for i in status.channels:
+                values.append((i - 192)/(1792 - 192))
+        return values
+
+    def write_frame(self, tx, length):
+        # 发送 tx 中已填好的 length 字节数据, 调用方需持有 tx_lock
+        frame = tx.frame(length)
+        t0 = time.perf_counter_ns()
+        self.port.write(frame)
+        self.write_latency.add((time.perf_counter_ns() - t0) // 1000)
+        self.bytes_out += length + 5
+        self.frames_out[tx.buf[2]] += 1
+
+    def stats(self):
+        # 链路统计快照, 从创建 Board 开始累计, 两次快照相减即为区间内的数值
+        # utilization 为串口占用率, 每字节按 10 位计算, 接近 1 表示链路饱和
+        parser = self.packet_parser
+        elapsed = time.monotonic() - self.start_time
+        with self.tx_lock:
+            bytes_out = self.bytes_out
+            frames_out = list(self.frames_out)
+            write_latency = self.write_latency.snapshot()
+        bytes_in = parser.bytes_in
+        return {
+            'uptime': elapsed,
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+            'rx_utilization': bytes_in * 10 / (self.baudrate * elapsed),
+            'tx_utilization': bytes_out * 10 / (self.baudrate * elapsed),
+            'frames_in': {PacketFunction(func).name[len('PACKET_FUNC_'):]: n
+                          for func, n in enumerate(parser.frame_counts) if n},
+            'frames_out': {PacketFunction(func).name[len('PACKET_FUNC_'):]: n
+                           for func, n in enumerate(frames_out) if n},
+            'crc_errors': parser.crc_errors,
+            'resyncs': parser.resyncs,
+            'discarded_bytes': max(bytes_in - parser.frame_bytes - len(parser.buf), 0),
+            'dropped_replies': self.dropped_replies,
+            'dropped_reports': self.dropped_reports,
+            'write_latency_us': write_latency,
+        }
+
     def buf_write(self, func, data):
-        buf = [0xAA, 0x55, int(func)]
-        buf.append(len(data))
-        buf.extend(data)
-        buf.append(checksum_crc8(bytes(buf[2:])))
-        self.port.write(buf)
+        tx = self.tx_buffers[func]
+        with self.tx_lock:
+            length = len(data)
+            tx.buf[4:4 + length] = data
+            self.write_frame(tx, length)
 
     def set_led(self, on_time, off_time, repeat=1, led_id=1):
         on_time = int(on_time*1000)
         off_time = int(off_time*1000)
-        self.buf_write(PacketFunction.PACKET_FUNC_LED, struct.pack("<BHHH", led_id, on_time, off_time, repeat))
+        tx = self.tx_led
+        with self.tx_lock:
+            led_struct.pack_into(tx.buf, 4, led_id, on_time, off_time, repeat)
+            self.write_frame(tx, led_struct.size)
 
     def set_buzzer(self, freq, on_time, off_time, repeat=1):
         on_time = int(on_time*1000)
         off_time = int(off_time*1000)
-        self.buf_write(PacketFunction.PACKET_FUNC_BUZZER, struct.pack("<HHHH", freq, on_time, off_time, repeat))
+        tx = self.tx_buzzer
+        with self.tx_lock:
+            buzzer_struct.pack_into(tx.buf, 4, freq, on_time, off_time, repeat)
+            self.write_frame(tx, buzzer_struct.size)
+
+    def write_motors(self, sub_cmd, motors):
+        tx = self.tx_motor
+        buf = tx.buf
+        with self.tx_lock:
+            cmd_count_struct.pack_into(buf, 4, sub_cmd, len(motors))
+            offset = 6
+            for motor_id, value in motors:
+                motor_struct.pack_into(buf, offset, int(motor_id - 1), float(value))
+                offset += 5
+            self.write_frame(tx, offset - 4)
 
     def set_motor_speed(self, speeds):
-        data = [0x01, len(speeds)]
-        for i in speeds:
-            data.extend(struct.pack("<Bf", int(i[0] - 1), float(i[1])))
-        self.buf_write(PacketFunction.PACKET_FUNC_MOTOR, data)
+        self.write_motors(0x01, speeds)
 
     def set_oled_text(self, line, text):
-        data = [line, len(text)] # 子命令为 0x01 设置 SSID, 第二个字节是字符串长度，该长度包含'\0'字符串结束符
-        data.extend(bytes(text, encoding='utf-8'))
-        self.buf_write(PacketFunction.PACKET_FUNC_OLED, data)
+        # 子命令为 0x01 设置 SSID, 第二个字节是字符串长度，该长度包含'\0'字符串结束符
+        data = bytes(text, encoding='utf-8')
+        tx = self.tx_oled
+        with self.tx_lock:
+            cmd_count_struct.pack_into(tx.buf, 4, line, len(text))
+            tx.buf[6:6 + len(data)] = data
+            self.write_frame(tx, 2 + len(data))
 
     def set_rgb(self, pixels):
-        data = [0x01, len(pixels), ]
-        for index, r, g, b in pixels:
-            data.extend(struct.pack("<BBBB", int(index - 1), int(r), int(g), int(b)))
-        self.buf_write(PacketFunction.PACKET_FUNC_RGB, data)
+        tx = self.tx_rgb
+        buf = tx.buf
+        with self.tx_lock:
+            cmd_count_struct.pack_into(buf, 4, 0x01, len(pixels))
+            offset = 6
+            for index, r, g, b in pixels:
+                rgb_struct.pack_into(buf, offset, int(index - 1), int(r), int(g), int(b))
+                offset += 4
+            self.write_frame(tx, offset - 4)
 
     def set_motor_duty(self, dutys):
-        data = [0x05, len(dutys)]
-        for i in dutys:
-            data.extend(struct.pack("<Bf", int(i[0] - 1), float(i[1])))
-        self.buf_write(PacketFunction.PACKET_FUNC_MOTOR, data)
+        self.write_motors(0x05, dutys)
 
-    def pwm_servo_set_position(self, duration, positions):
+    def write_servo_positions(self, tx, duration, positions):
         duration = int(duration * 1000)
-        data = [0x01, duration & 0xFF, 0xFF & (duration >> 8), len(positions)]
-        for i in positions:
-            data.extend(struct.pack("<BH", i[0], i[1]))
-        self.buf_write(PacketFunction.PACKET_FUNC_PWM_SERVO, data)
+        buf = tx.buf
+        with self.tx_lock:
+            servo_move_struct.pack_into(buf, 4, 0x01, duration & 0xFFFF, len(positions))
+            offset = 8
+            for servo_id, position in positions:
+                servo_position_struct.pack_into(buf, offset, servo_id, position)
+                offset += 3
+            self.write_frame(tx, offset - 4)
+
+    def write_servo_cmd(self, tx, cmd_struct, *args):
+        with self.tx_lock:
+            cmd_struct.pack_into(tx.buf, 4, *args)
+            self.write_frame(tx, cmd_struct.size)
+
+    def pwm_servo_set_position(self, duration, positions):
+        self.write_servo_positions(self.tx_pwm_servo, duration, positions)
     
     def pwm_servo_set_offset(self, servo_id, offset):
-        data = struct.pack("<BBb", 0x07, servo_id, int(offset))
-        self.buf_write(PacketFunction.PACKET_FUNC_PWM_SERVO, data)
+        self.write_servo_cmd(self.tx_pwm_servo, servo_offset_struct, 0x07, servo_id, int(offset))
+
+    def request_reply(self, tx, func, cmd, servo_id, timeout):
+        # 发送读取指令并等待对应的应答, 超过 timeout 秒返回 None
+        self.wait_late_reply(func, cmd, servo_id)
+        replies = []
+        received = threading.Event()
+        def on_reply(data):
+            replies.append(data)
+            received.set()
+        self.add_reply_waiter(func, cmd, servo_id, on_reply)
+        try:
+            self.write_servo_cmd(tx, servo_cmd_struct, cmd, servo_id)
+        except BaseException:
+            self.remove_reply_waiter(func, cmd, servo_id, on_reply)
+            raise
+        if not received.wait(timeout) and self.remove_reply_waiter(func, cmd, servo_id, on_reply, late=True):
+            return None
+        # 应答可能恰好在超时时被取走, 回调马上就会执行
+        received.wait()
+        return replies[0]
 
     def pwm_servo_read_and_unpack(self, servo_id, cmd, unpack):
         with self.servo_read_lock:
-            self.buf_write(PacketFunction.PACKET_FUNC_PWM_SERVO, [cmd, servo_id])
-            data = self.pwm_servo_queue.get(block=True)
+            data = self.request_reply(self.tx_pwm_servo, PacketFunction.PACKET_FUNC_PWM_SERVO, cmd, servo_id, self.reply_timeout)
+            if data is None:
+                return None
             servo_id, cmd, info = struct.unpack(unpack, data)
             return info
 
@@ -376,59 +807,49 @@ class Board:
         return self.pwm_servo_read_and_unpack(servo_id, 0x05, "<BBH")
 
     def bus_servo_enable_torque(self, servo_id, enable):
-        if enable:
-            data = struct.pack("<BB", 0x0B, servo_id)
-        else:
-            data = struct.pack("<BB", 0x0C, servo_id)
-        self.buf_write(PacketFunction.PACKET_FUNC_BUS_SERVO, data)
+        self.write_servo_cmd(self.tx_bus_servo, servo_cmd_struct, 0x0B if enable else 0x0C, servo_id)
         time.sleep(0.02)
 
     def bus_servo_set_id(self, servo_id_now, servo_id_new):
-        data = struct.pack("<BBB", 0x10, servo_id_now, servo_id_new)
-        self.buf_write(PacketFunction.PACKET_FUNC_BUS_SERVO, data)
+        self.write_servo_cmd(self.tx_bus_servo, servo_set_id_struct, 0x10, servo_id_now, servo_id_new)
         time.sleep(0.02)
 
     def bus_servo_set_offset(self, servo_id, offset):
-        data = struct.pack("<BBb", 0x20, servo_id, int(offset))
-        self.buf_write(PacketFunction.PACKET_FUNC_BUS_SERVO, data)
+        self.write_servo_cmd(self.tx_bus_servo, servo_offset_struct, 0x20, servo_id, int(offset))
         time.sleep(0.02)
 
     def bus_servo_save_offset(self, servo_id):
-        data = struct.pack("<BB", 0x24, servo_id)
-        self.buf_write(PacketFunction.PACKET_FUNC_BUS_SERVO, data)
+        self.write_servo_cmd(self.tx_bus_servo, servo_cmd_struct, 0x24, servo_id)
         time.sleep(0.02)
 
     def bus_servo_set_angle_limit(self, servo_id, limit):
-        data = struct.pack("<BBHH", 0x30, servo_id, int(limit[0]), int(limit[1]))
-        self.buf_write(PacketFunction.PACKET_FUNC_BUS_SERVO, data)
+        self.write_servo_cmd(self.tx_bus_servo, servo_limit_struct, 0x30, servo_id, int(limit[0]), int(limit[1]))
         time.sleep(0.02)
 
     def bus_servo_set_vin_limit(self, servo_id, limit):
-        data = struct.pack("<BBHH", 0x34, servo_id, int(limit[0]), int(limit[1]))
-        self.buf_write(PacketFunction.PACKET_FUNC_BUS_SERVO, data)
+        self.write_servo_cmd(self.tx_bus_servo, servo_limit_struct, 0x34, servo_id, int(limit[0]), int(limit[1]))
         time.sleep(0.02)
 
     def bus_servo_set_temp_limit(self, servo_id, limit):
-        data = struct.pack("<BBb", 0x38, servo_id, int(limit))
-        self.buf_write(PacketFunction.PACKET_FUNC_BUS_SERVO, data)
+        self.write_servo_cmd(self.tx_bus_servo, servo_offset_struct, 0x38, servo_id, int(limit))
         time.sleep(0.02)
 
     def bus_servo_stop(self, servo_id):
-        data = [0x03, len(servo_id)] 
-        data.extend(struct.pack("<"+'B'*len(servo_id), *servo_id))
-        self.buf_write(PacketFunction.PACKET_FUNC_BUS_SERVO, data)
+        tx = self.tx_bus_servo
+        with self.tx_lock:
+            cmd_count_struct.pack_into(tx.buf, 4, 0x03, len(servo_id))
+            tx.buf[6:6 + len(servo_id)] = bytes(servo_id)
+            self.write_frame(tx, 2 + len(servo_id))
 
     def bus_servo_set_position(self, duration, positions):
-        duration = int(duration * 1000)
-        data = [0x01, duration & 0xFF, 0xFF & (duration >> 8), len(positions)] # 0x00 is bus servo sub command
-        for i in positions:
-            data.extend(struct.pack("<BH", i[0], i[1]))
-        self.buf_write(PacketFunction.PACKET_FUNC_BUS_SERVO, data)
+        # 0x01 为总线舵机子命令
+        self.write_servo_positions(self.tx_bus_servo, duration, positions)
 
     def bus_servo_read_and_unpack(self, servo_id, cmd, unpack):
         with self.servo_read_lock:
-            self.buf_write(PacketFunction.PACKET_FUNC_BUS_SERVO, [cmd, servo_id])
-            data = self.bus_servo_queue.get(block=True)
+            data = self.request_reply(self.tx_bus_servo, PacketFunction.PACKET_FUNC_BUS_SERVO, cmd, servo_id, self.reply_timeout)
+            if data is None:
+                return None
             servo_id, cmd, success, *info = struct.unpack(unpack, data)
             if success == 0:
                 return info
@@ -460,59 +881,73 @@ class Board:
     def bus_servo_read_torque_state(self, servo_id):
         return self.bus_servo_read_and_unpack(servo_id, 0x0D, "<BBbb")
 
+    def read_servo_states(self, ids, fields=('position', 'temp', 'vin'), timeout=0.05, window=8):
+        # 批量读取总线舵机状态, 最多 window 条读取指令同时在途, 应答到达即处理
+        # 每条指令超过 timeout 秒没有应答则记为该字段的标记值, 见 servo_state_fields
+        # 上一次读取超时且迟到的应答还可能到达的字段不发指令, 同样记为标记值, 不等待也不会收到旧的应答
+        dtype = [('id', 'u1')] + [(name, servo_state_fields[name][2]) for name in fields]
+        states = np.empty(len(ids), dtype=dtype)
+        states['id'] = ids
+        for name in fields:
+            states[name] = servo_state_fields[name][3]
+
+        requests = [(index, servo_id, name) for index, servo_id in enumerate(ids) for name in fields]
+        cond = threading.Condition()
+        replies = {}
+        pending = {}  # 请求序号 -> (截止时间, 回调)
+        def waiter(n):
+            def on_reply(data):
+                with cond:
+                    replies[n] = data
+                    cond.notify()
+            return on_reply
+
+        next_request = 0
+        with self.servo_read_lock, cond:
+            while next_request < len(requests) or pending:
+                while next_request < len(requests) and len(pending) < window:
+                    index, servo_id, name = requests[next_request]
+                    cmd = servo_state_fields[name][0]
+                    if self.late_reply_delay(PacketFunction.PACKET_FUNC_BUS_SERVO, cmd, servo_id):
+                        next_request += 1
+                        continue
+                    callback = waiter(next_request)
+                    self.add_reply_waiter(PacketFunction.PACKET_FUNC_BUS_SERVO, cmd, servo_id, callback)
+                    pending[next_request] = (time.monotonic() + timeout, callback)
+                    self.write_servo_cmd(self.tx_bus_servo, servo_cmd_struct, cmd, servo_id)
+                    next_request += 1
+
+                now = time.monotonic()
+                wait = None
+                for n, (deadline, callback) in list(pending.items()):
+                    index, servo_id, name = requests[n]
+                    data = replies.pop(n, None)
+                    if data is not None:
+                        _, _, success, value = servo_state_fields[name][1].unpack(data)
+                        if success == 0:
+                            states[name][index] = value
+                        del pending[n]
+                    elif deadline <= now:
+                        if self.remove_reply_waiter(PacketFunction.PACKET_FUNC_BUS_SERVO, servo_state_fields[name][0], servo_id, callback, late=True):
+                            del pending[n]
+                        # 否则应答刚被取走, 回调执行后在下一轮处理
+                    elif wait is None or deadline - now < wait:
+                        wait = deadline - now
+                if pending and (next_request >= len(requests) or len(pending) >= window):
+                    cond.wait(wait)
+        return states
+
     def enable_reception(self, enable=True):
         self.enable_recv = enable
 
     def recv_task(self):
+        parser = self.packet_parser
         while True:
             if self.enable_recv:
-                recv_data = self.port.read()
+                # 一次读出缓冲区里的全部数据, 没有数据时阻塞等待1个字节
+                recv_data = self.port.read(self.port.in_waiting or 1)
                 if recv_data:
-                    for dat in recv_data:
-                        # print("%0.2X "%dat)
-                        if self.state == PacketControllerState.PACKET_CONTROLLER_STATE_STARTBYTE1:
-                            if dat == 0xAA:
-                                self.state = PacketControllerState.PACKET_CONTROLLER_STATE_STARTBYTE2
-                            continue
-                        elif self.state == PacketControllerState.PACKET_CONTROLLER_STATE_STARTBYTE2:
-                            if dat == 0x55:
-                                self.state = PacketControllerState.PACKET_CONTROLLER_STATE_FUNCTION
-                            else:
-                                self.state = PacketControllerState.PACKET_CONTROLLER_STATE_STARTBYTE1
-                            continue
-                        elif self.state == PacketControllerState.PACKET_CONTROLLER_STATE_FUNCTION:
-                            if dat < int(PacketFunction.PACKET_FUNC_NONE):
-                                self.frame = [dat, 0]
-                                self.state = PacketControllerState.PACKET_CONTROLLER_STATE_LENGTH
-                            else:
-                                self.frame = []
-                                self.state = PacketControllerState.PACKET_CONTROLLER_STATE_STARTBYTE1
-                            continue
-                        elif self.state == PacketControllerState.PACKET_CONTROLLER_STATE_LENGTH:
-                            self.frame[1] = dat
-                            self.recv_count = 0
-                            if dat == 0:
-                                self.state = PacketControllerState.PACKET_CONTROLLER_STATE_CHECKSUM
-                            else:
-                                self.state = PacketControllerState.PACKET_CONTROLLER_STATE_DATA
-                            continue
-                        elif self.state == PacketControllerState.PACKET_CONTROLLER_STATE_DATA:
-                            self.frame.append(dat)
-                            self.recv_count += 1
-                            if self.recv_count >= self.frame[1]:
-                                self.state = PacketControllerState.PACKET_CONTROLLER_STATE_CHECKSUM
-                            continue
-                        elif self.state == PacketControllerState.PACKET_CONTROLLER_STATE_CHECKSUM:
-                            crc8 = checksum_crc8(bytes(self.frame))
-                            if crc8 == dat:
-                                func = PacketFunction(self.frame[0])
-                                data = bytes(self.frame[2:])
-                                if func in self.parsers:
-                                    self.parsers[func](data)
-                            else:
-                                print("校验失败")
-                            self.state = PacketControllerState.PACKET_CONTROLLER_STATE_STARTBYTE1
-                            continue
+                    parser.feed(recv_data)
             else:
                 time.sleep(0.01)
         self.port.close()
@@ -556,6 +991,7 @@ def bus_servo_test(board):
         print('vin_limit:', board.bus_servo_read_vin_limit(servo_id), [vin_l, vin_h])
         print('temp_limit:', board.bus_servo_read_temp_limit(servo_id), temp_limit)
         print('torque_state:', board.bus_servo_read_torque_state(servo_id))
+        print('states:', board.read_servo_states([servo_id], ('position', 'temp', 'vin', 'offset')))
 
 def pwm_servo_test(board):
     servo_id = 1
@@ -580,25 +1016,14 @@ if __name__ == "__main__":
     # pwm_servo_test(board)
     # board.set_oled_text(1, "SSID:HW-ABC123")
     # board.set_oled_text(2, "IP:192.168.149.1")
+    # 上报数据到达时直接回调, 不需要轮询
+    # board.subscribe(PacketFunction.PACKET_FUNC_IMU, lambda imu, timestamp: print(imu), rate=10)
+    # board.subscribe(PacketFunction.PACKET_FUNC_KEY, lambda key, timestamp: print(key))
+    # board.subscribe(PacketFunction.PACKET_FUNC_GAMEPAD, lambda gamepad, timestamp: print(*gamepad, sep='\n'))
+    # board.subscribe(PacketFunction.PACKET_FUNC_SBUS, lambda sbus, timestamp: print(sbus))
+    board.subscribe(PacketFunction.PACKET_FUNC_SYS, lambda voltage, timestamp: print(voltage))
     while True:
         try:
-            # res = board.get_imu()
-            # if res is not None:
-                # print(res)
-            # res = board.get_button()
-            # if res is not None:
-                # print(res)
-            # data = board.get_gamepad()
-            # if data is not None:
-                # print(data[0])
-                # print(data[1])
-            # res = board.get_sbus()
-            # if res is not None:
-                # print(res)
-            res = board.get_battery()
-            if res is not None:
-                print(res)
-            time.sleep(0.001)
+            time.sleep(1)
         except KeyboardInterrupt:
             break
-
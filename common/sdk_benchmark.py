@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+# 串口协议性能测试, 不需要连接控制板
+# 覆盖校验计算, 指令编码, 数据流解析, 上报数据解码和麦轮底盘速度控制
+# 结果可保存为 JSON 基线, 之后用 --compare 对比, 变慢或内存占用增加超过阈值的项目会标出
+# 用法: python3 common/sdk_benchmark.py --save baseline.json
+#      python3 common/sdk_benchmark.py --compare baseline.json
+#      python3 common/sdk_benchmark.py --record /dev/ttyAMA0 --seconds 10 --stream report.bin
+import os
+import sys
+import tty
+import json
+import time
+import struct
+import argparse
+import platform
+import threading
+import tracemalloc
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.ros_robot_controller_sdk import Board, PacketFunction, PacketParser, checksum_crc8
+from common.virtual_board import make_frame
+
+imu_payload = struct.pack('<6f', 0.01, -0.02, 9.8, 0.1, 0.2, 0.3)
+gamepad_payload = struct.pack('<HB4b', 0x0100, 15, 10, -20, 30, -40)
+sbus_payload = struct.pack('<16hBBBB', *range(192, 208), 0, 1, 0, 0)
+battery_payload = struct.pack('<BH', 0x04, 7400)
+
+def make_report_stream(count=1000):
+    # 按实际上报比例合成 IMU/手柄/SBUS/电池数据流
+    imu = make_frame(PacketFunction.PACKET_FUNC_IMU, imu_payload)
+    gamepad = make_frame(PacketFunction.PACKET_FUNC_GAMEPAD, gamepad_payload)
+    sbus = make_frame(PacketFunction.PACKET_FUNC_SBUS, sbus_payload)
+    battery = make_frame(PacketFunction.PACKET_FUNC_SYS, battery_payload)
+    stream = bytearray()
+    for i in range(count):
+        stream += imu
+        stream += gamepad
+        stream += sbus
+        if i % 10 == 0:
+            stream += battery
+    return bytes(stream)
+
+def record_stream(device, seconds, path, baudrate=1000000):
+    # 从串口录制原始字节流, 之后可用 --stream 回放
+    import serial
+    port = serial.Serial(device, baudrate, timeout=0.1)
+    data = bytearray()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        data += port.read(port.in_waiting or 1)
+    port.close()
+    with open(path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+def bench_parser(stream, chunk_size=256, repeat=5):
+    # 返回 (B/s, frames/s)
+    frames = [0]
+    def count(data):
+        frames[0] += 1
+    parser = PacketParser({func: count for func in PacketFunction})
+    chunks = [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+    best = None
+    for _ in range(repeat):
+        frames[0] = 0
+        t0 = time.perf_counter()
+        for chunk in chunks:
+            parser.feed(chunk)
+        elapsed = time.perf_counter() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(stream) / best, frames[0] / best
+
+def parser_alloc(stream, chunk_size=256):
+    # 解析一遍数据流的临时内存峰值, 按帧数平均
+    frames = [0]
+    def count(data):
+        frames[0] += 1
+    parser = PacketParser({func: count for func in PacketFunction})
+    chunks = [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+    tracemalloc.start()
+    current = tracemalloc.get_traced_memory()[0]
+    for chunk in chunks:
+        parser.feed(chunk)
+    peak = tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    return peak / max(frames[0], 1)
+
+def open_pty_board():
+    # 用伪终端代替控制板串口, 后台线程把写出的数据读掉
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    board = Board(device=os.ttyname(slave))
+    def drain():
+        # 读入固定缓冲区, 避免影响内存统计
+        buf = bytearray(4096)
+        while True:
+            os.readv(master, [buf])
+    threading.Thread(target=drain, daemon=True).start()
+    return board
+
+def bench_call(func, number=2000, repeat=20):
+    # 返回 (每次调用耗时 us, 单次调用的临时内存峰值 bytes)
+    func()
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter() - t0) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    tracemalloc.start()
+    func()
+    tracemalloc.reset_peak()
+    current = tracemalloc.get_traced_memory()[0]
+    func()
+    peak = tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    return best * 1e6, peak
+
+def bench_crc8():
+    short = bytes(range(8))
+    long = bytes(range(64))
+    return {
+        'checksum_crc8[8B]': bench_call(lambda: checksum_crc8(short)),
+        'checksum_crc8[64B]': bench_call(lambda: checksum_crc8(long)),
+    }
+
+def bench_encoder(board):
+    dutys = [[1, -50], [2, 50], [3, 50], [4, -50]]
+    raw = bytes([0x05, 0x01, 0x00]) + struct.pack('<f', 50)
+    cases = {
+        'buf_write': lambda: board.buf_write(PacketFunction.PACKET_FUNC_MOTOR, raw),
+        'set_motor_duty': lambda: board.set_motor_duty(dutys),
+        'pwm_servo_set_position': lambda: board.pwm_servo_set_position(0.1, [[5, 1500]]),
+        'bus_servo_set_position': lambda: board.bus_servo_set_position(0.1, [[1, 500], [2, 500]]),
+        'set_rgb': lambda: board.set_rgb([[1, 255, 0, 0], [2, 0, 0, 255]]),
+    }
+    return {name: bench_call(func) for name, func in cases.items()}
+
+def bench_decoder(board):
+    # get_* 读取环形缓冲区中的最新一帧并解码, 与接收线程的数据无关
+    board.enable_reception()
+    board.imu_ring.push(imu_payload)
+    board.gamepad_ring.push(gamepad_payload)
+    board.sbus_ring.push(sbus_payload)
+    board.battery_ring.push(battery_payload[1:])
+    forever = float('inf')
+    cases = {
+        'get_imu': lambda: board.get_imu(forever),
+        'get_gamepad': lambda: board.get_gamepad(forever),
+        'get_sbus': lambda: board.get_sbus(forever),
+        'get_battery': lambda: board.get_battery(forever),
+        'decode_gamepad': lambda: board.decode_gamepad(gamepad_payload),
+        'decode_sbus': lambda: board.decode_sbus(sbus_payload),
+    }
+    return {name: bench_call(func) for name, func in cases.items()}
+
+def bench_mecanum(device):
+    # mecanum 在导入时打开控制板, 先把默认串口指向伪终端
+    Board.default_device = device
+    import common.mecanum as mecanum
+    chassis = mecanum.MecanumChassis()
+    speeds = [50, 60]
+    def changing():
+        speeds.reverse()
+        chassis.set_velocity(speeds[0], 90, 0)
+    return {
+        'set_velocity[unchanged]': bench_call(lambda: chassis.set_velocity(50, 90, 0)),
+        'set_velocity[changed]': bench_call(changing),
+    }
+
+def run(stream):
+    results = {}
+    for chunk_size in (1, 16, 256, 4096):
+        bytes_per_s, frames_per_s = bench_parser(stream, chunk_size)
+        results['parser[chunk=%d]' % chunk_size] = {
+            'bytes_per_s': bytes_per_s,
+            'frames_per_s': frames_per_s,
+            'us_per_op': 1e6 / frames_per_s,
+            'alloc_per_op': parser_alloc(stream, chunk_size),
+        }
+    board = open_pty_board()
+    cases = {}
+    cases.update(bench_crc8())
+    cases.update(bench_encoder(board))
+    cases.update(bench_decoder(board))
+    cases.update(bench_mecanum(board.port.port))
+    for name, (us, peak) in cases.items():
+        results[name] = {'us_per_op': us, 'alloc_per_op': peak}
+    return results
+
+def report(results, baseline=None, threshold=0.1):
+    # 与基线对比时, 耗时或内存增加超过 threshold 的项目标记为 REGRESSION, 返回标记的数量
+    regressions = 0
+    for name, result in results.items():
+        line = '%-28s %8.2f us/op  %7.0f B alloc/op' % (name, result['us_per_op'], result['alloc_per_op'])
+        if 'frames_per_s' in result:
+            line += '  %9.0f frames/s' % result['frames_per_s']
+        old = (baseline or {}).get(name)
+        if old is not None:
+            change = result['us_per_op'] / old['us_per_op'] - 1
+            line += '  %+6.1f%%' % (change * 100)
+            if change > threshold or result['alloc_per_op'] > old['alloc_per_op'] * (1 + threshold) + 16:
+                line += '  REGRESSION'
+                regressions += 1
+        print(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='串口协议性能测试')
+    parser.add_argument('--stream', help='回放录制的串口数据, 不指定时使用合成数据')
+    parser.add_argument('--record', metavar='DEVICE', help='从串口录制数据到 --stream 指定的文件')
+    parser.add_argument('--seconds', type=float, default=10, help='录制时长(秒)')
+    parser.add_argument('--save', help='保存结果为 JSON 基线')
+    parser.add_argument('--compare', help='与 JSON 基线对比')
+    parser.add_argument('--threshold', type=float, default=0.2, help='判定为退化的比例, 测试机负载不稳定时适当调大')
+    args = parser.parse_args()
+
+    if args.record:
+        if not args.stream:
+            parser.error('--record 需要同时指定 --stream')
+        print('recorded %d bytes' % record_stream(args.record, args.seconds, args.stream))
+        return 0
+
+    if args.stream:
+        with open(args.stream, 'rb') as f:
+            stream = f.read()
+        if not bench_parser(stream, repeat=1)[1]:
+            # 没有可计时的帧, 解析速度无从计算
+            print('%s 中没有有效的数据帧 (%d 字节)' % (args.stream, len(stream)))
+            return 1
+    else:
+        stream = make_report_stream()
+
+    results = run(stream)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    regressions = report(results, baseline, args.threshold)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'stream': args.stream or 'synthetic',
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+# 基于伪终端的虚拟 STM32 控制板, 不需要硬件即可运行 SDK 和网页程序
+# 按真实协议应答总线/PWM舵机读取指令, 定时上报 IMU/手柄/SBUS/电池数据, 并记录收到的所有控制指令
+# 用法: python3 common/virtual_board.py, 然后以打印出的路径创建 Board(device=...)
+#      或设置环境变量 BOARD_DEVICE 后启动 app.py
+import os
+import sys
+import tty
+import math
+import time
+import errno
+import random
+import select
+import struct
+import argparse
+import threading
+from collections import deque
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.ros_robot_controller_sdk import PacketFunction, PacketParser, checksum_crc8
+
+# 总线舵机读取指令 -> (状态字段, 应答数据格式)
+bus_servo_reads = {
+    0x05: ('position', '<h'),
+    0x07: ('vin', '<H'),
+    0x09: ('temp', '<B'),
+    0x0D: ('torque_state', '<b'),
+    0x12: ('id', '<B'),
+    0x22: ('offset', '<b'),
+    0x32: ('angle_limit', '<2H'),
+    0x36: ('vin_limit', '<2H'),
+    0x3A: ('temp_limit', '<B'),
+}
+
+# PWM 舵机读取指令 -> (状态字段, 应答数据格式)
+pwm_servo_reads = {
+    0x05: ('position', '<H'),
+    0x09: ('offset', '<b'),
+}
+
+def make_frame(func, payload):
+    body = bytes([int(func), len(payload)]) + payload
+    return b'\xaa\x55' + body + bytes([checksum_crc8(body)])
+
+class VirtualBoard:
+    def __init__(self, imu_rate=100, gamepad_rate=50, sbus_rate=70, battery_rate=1,
+                 bus_servo_ids=(1, 2, 3, 4, 5, 6), reply_delay=0, history=None):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        # 没有程序打开串口时上报数据会写满缓冲区, 这时直接丢弃, 与真实串口一致
+        os.set_blocking(self.master, False)
+        self.device = os.ttyname(self.slave)
+
+        self.rates = {
+            PacketFunction.PACKET_FUNC_IMU: imu_rate,
+            PacketFunction.PACKET_FUNC_GAMEPAD: gamepad_rate,
+            PacketFunction.PACKET_FUNC_SBUS: sbus_rate,
+            PacketFunction.PACKET_FUNC_SYS: battery_rate,
+        }  # 各类上报的频率(Hz), 0 表示不上报
+        self.reply_delay = reply_delay  # 模拟舵机应答延迟(秒)
+
+        # 模拟的上报内容, 可在运行时修改
+        self.imu = [0.0, 0.0, 9.8, 0.0, 0.0, 0.0]  # ax, ay, az, gx, gy, gz
+        self.gamepad = [0, 0, 0, 0, 0, 0]  # buttons, hat, lx, ly, rx, ry
+        self.sbus = [992] * 16 + [0, 0, 0, 0]  # 16 个通道, ch17, ch18, signal_loss, fail_safe
+        self.battery = 7400  # mV
+        self.noise = 0.02  # IMU 数据的随机扰动幅度
+
+        self.motors = {}  # 电机 1-4 -> (子命令, 值)
+        self.rgb = {}  # 灯珠序号 -> (r, g, b)
+        self.oled = {}  # 行号 -> 文本
+        self.pwm_servos = {}  # 舵机ID -> {'position', 'offset'}, 首次使用时创建
+        self.bus_servos = {servo_id: self.new_bus_servo(servo_id) for servo_id in bus_servo_ids}
+
+        # 收到的每一条指令 (时间戳, 功能, 数据), history 为保留的最大条数, None 表示不限
+        self.commands = deque(maxlen=history)
+        self.counts = {}  # 功能 -> 收到的指令数
+        self.dropped = 0  # 因对方未读取而丢弃的上报帧数
+
+        self.lock = threading.RLock()
+        self.write_lock = threading.Lock()
+        self.running = False
+        self.threads = []
+        self.parser = PacketParser({func: self.make_handler(func) for func in PacketFunction
+                                    if func != PacketFunction.PACKET_FUNC_NONE})
+        self.handlers = {
+            PacketFunction.PACKET_FUNC_MOTOR: self.handle_motor,
+            PacketFunction.PACKET_FUNC_PWM_SERVO: self.handle_pwm_servo,
+            PacketFunction.PACKET_FUNC_BUS_SERVO: self.handle_bus_servo,
+            PacketFunction.PACKET_FUNC_RGB: self.handle_rgb,
+            PacketFunction.PACKET_FUNC_OLED: self.handle_oled,
+        }
+
+    def new_bus_servo(self, servo_id):
+        return {
+            'id': servo_id,
+            'position': 500,
+            'target': 500,
+            'vin': 7400,
+            'temp': 35,
+            'temp_limit': 85,
+            'torque_state': 1,
+            'offset': 0,
+            'angle_limit': (0, 1000),
+            'vin_limit': (4500, 14000),
+        }
+
+    def start(self):
+        self.running = True
+        for target in (self.recv_task, self.report_task):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def close(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        os.close(self.master)
+        os.close(self.slave)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write(self, data):
+        with self.write_lock:
+            try:
+                os.write(self.master, data)
+            except BlockingIOError:
+                self.dropped += 1
+            except OSError as e:
+                if e.errno != errno.EIO:
+                    raise
+
+    def recv_task(self):
+        while self.running:
+            readable, _, _ = select.select([self.master], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                data = os.read(self.master, 4096)
+            except (BlockingIOError, OSError):
+                continue
+            self.parser.feed(data)
+
+    def report_task(self):
+        # 各类上报按各自频率发送, 统一由一个线程调度
+        due = {func: time.monotonic() for func in self.rates}
+        while self.running:
+            now = time.monotonic()
+            for func, rate in self.rates.items():
+                if rate and now >= due[func]:
+                    self.write(make_frame(func, self.report_payload(func, now)))
+                    due[func] = max(due[func] + 1.0 / rate, now - 1.0 / rate)
+            pending = [due[func] for func, rate in self.rates.items() if rate]
+            time.sleep(min(max(min(pending) - time.monotonic(), 0), 0.05) if pending else 0.05)
+
+    def report_payload(self, func, now):
+        with self.lock:
+            if func == PacketFunction.PACKET_FUNC_IMU:
+                imu = [v + random.uniform(-self.noise, self.noise) for v in self.imu]
+                imu[5] += 0.1 * math.sin(now)
+                return struct.pack('<6f', *imu)
+            if func == PacketFunction.PACKET_FUNC_GAMEPAD:
+                return struct.pack('<HB4b', *self.gamepad)
+            if func == PacketFunction.PACKET_FUNC_SBUS:
+                return struct.pack('<16hBBBB', *self.sbus)
+            return struct.pack('<BH', 0x04, self.battery)
+
+    def press_key(self, key_id=1, event=0x20):
+        # 发送一次按键事件, event 为 PacketReportKeyEvents 中的值
+        self.write(make_frame(PacketFunction.PACKET_FUNC_KEY, bytes([key_id, event])))
+
+    def make_handler(self, func):
+        def handler(data):
+            data = bytes(data)
+            with self.lock:
+                self.commands.append((time.monotonic(), func, data))
+                self.counts[func] = self.counts.get(func, 0) + 1
+                handle = self.handlers.get(func)
+                reply = handle(data) if handle is not None else None
+            if reply is not None:
+                if self.reply_delay:
+                    threading.Timer(self.reply_delay, self.write, (make_frame(func, reply),)).start()
+                else:
+                    self.write(make_frame(func, reply))
+        return handler
+
+    def handle_motor(self, data):
+        sub_cmd, count = data[0], data[1]
+        for i in range(count):
+            motor_id, value = struct.unpack_from('<Bf', data, 2 + i * 5)
+            self.motors[motor_id + 1] = (sub_cmd, value)
+
+    def handle_rgb(self, data):
+        for i in range(data[1]):
+            index, r, g, b = data[2 + i * 4:6 + i * 4]
+            self.rgb[index + 1] = (r, g, b)
+
+    def handle_oled(self, data):
+        self.oled[data[0]] = data[2:2 + data[1]].decode('utf-8', 'replace')
+
+    def pwm_servo(self, servo_id):
+        return self.pwm_servos.setdefault(servo_id, {'position': 1500, 'offset': 0})
+
+    def handle_pwm_servo(self, data):
+        cmd = data[0]
+        if cmd == 0x01:
+            for servo_id, position in self.unpack_positions(data):
+                self.pwm_servo(servo_id)['position'] = position
+        elif cmd == 0x07:
+            servo_id, offset = struct.unpack_from('<Bb', data, 1)
+            self.pwm_servo(servo_id)['offset'] = offset
+        elif cmd in pwm_servo_reads:
+            # 读取指令为 [子命令, 舵机ID], 应答为 [舵机ID, 子命令, 数据]
+            servo_id = data[1]
+            name, fmt = pwm_servo_reads[cmd]
+            return bytes([servo_id, cmd]) + struct.pack(fmt, self.pwm_servo(servo_id)[name])
+
+    def handle_bus_servo(self, data):
+        cmd = data[0]
+        if cmd == 0x01:
+            for servo_id, position in self.unpack_positions(data):
+                if servo_id in self.bus_servos:
+                    # 不模拟运动过程, 直接到达目标位置
+                    self.bus_servos[servo_id]['target'] = position
+                    self.bus_servos[servo_id]['position'] = position
+            return None
+        if cmd == 0x03:
+            return None
+        servo_id = data[1]
+        if cmd == 0x12 and servo_id == 254 and self.bus_servos:
+            # 广播读取 ID, 由总线上的第一个舵机应答
+            servo_id = min(self.bus_servos)
+        servo = self.bus_servos.get(servo_id)
+        if servo is None:
+            # 总线上没有该舵机, 不应答
+            return None
+        if cmd in (0x0B, 0x0C):
+            servo['torque_state'] = 1 if cmd == 0x0B else 0
+        elif cmd == 0x10:
+            new_id = data[2]
+            servo['id'] = new_id
+            self.bus_servos[new_id] = self.bus_servos.pop(servo_id)
+        elif cmd == 0x20:
+            servo['offset'] = struct.unpack_from('<b', data, 2)[0]
+        elif cmd == 0x30:
+            servo['angle_limit'] = struct.unpack_from('<2H', data, 2)
+        elif cmd == 0x34:
+            servo['vin_limit'] = struct.unpack_from('<2H', data, 2)
+        elif cmd == 0x38:
+            servo['temp_limit'] = data[2]
+        elif cmd in bus_servo_reads:
+            name, fmt = bus_servo_reads[cmd]
+            value = servo[name]
+            value = struct.pack(fmt, *value) if isinstance(value, tuple) else struct.pack(fmt, value)
+            return bytes([servo_id, cmd, 0]) + value
+
+    def unpack_positions(self, data):
+        # 位置指令: 子命令, 时间(ms), 数量, 然后每个舵机为 ID + 位置
+        count = data[3]
+        return [struct.unpack_from('<BH', data, 4 + i * 3) for i in range(count)]
+
+    def commands_for(self, func):
+        # 返回收到的某一功能的全部指令 [(时间戳, 数据)]
+        with self.lock:
+            return [(timestamp, data) for timestamp, f, data in self.commands if f == func]
+
+def main():
+    parser = argparse.ArgumentParser(description='基于伪终端的虚拟控制板')
+    parser.add_argument('--imu-rate', type=float, default=100)
+    parser.add_argument('--gamepad-rate', type=float, default=50)
+    parser.add_argument('--sbus-rate', type=float, default=70)
+    parser.add_argument('--battery-rate', type=float, default=1)
+    parser.add_argument('--reply-delay', type=float, default=0, help='舵机应答延迟(秒)')
+    parser.add_argument('--servos', type=int, nargs='*', default=[1, 2, 3, 4, 5, 6], help='总线上的舵机ID')
+    args = parser.parse_args()
+
+    board = VirtualBoard(args.imu_rate, args.gamepad_rate, args.sbus_rate, args.battery_rate,
+                         args.servos, args.reply_delay, history=10000)
+    with board:
+        print(board.device, flush=True)
+        print('BOARD_DEVICE=%s python3 app.py' % board.device, flush=True)
+        counts = {}
+        while True:
+            try:
+                time.sleep(1)
+            except KeyboardInterrupt:
+                break
+            with board.lock:
+                if board.counts != counts:
+                    counts = dict(board.counts)
+                    print({PacketFunction(func).name: n for func, n in counts.items()}, board.motors, flush=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# encoding:utf-8
+# 摄像头画面的 JPEG 广播: 每一帧只编码一次, 所有 MJPEG 观看者共用编码结果
+# 观看者总是取最新的一帧, 读取慢的观看者直接跳过中间的帧, 不会积压
+# 没有观看者时不编码, 摄像头处于直通模式时直接转发摄像头输出的 JPEG, 不解码也不编码
+# 观看者可以指定帧率, JPEG 质量和缩放比例, 相同 (质量, 缩放) 的观看者共用一份编码结果
+# 质量和缩放取 QUALITY_STEPS / SCALE_STEPS 中最接近的值, 每帧最多编码固定的几种画质
+# 自适应模式根据每帧的发送耗时在 ADAPTIVE_LEVELS 中逐级降低或提高画质, 保持延迟不超过目标值
+# 可选的变化检测: 画面与上一次编码的画面几乎相同时不编码也不发送, 每隔 heartbeat 秒仍发送一帧
+# latency 记录画面在各阶段距采集的耗时: encode 为编码完成, sent 为发给观看者完成, write 为发送本身的耗时
+import cv2
+import time
+import itertools
+import threading
+import collections
+import numpy as np
+from pipeline_stats import PipelineStats
+from jpeg_encoder import select_encoder
+
+# 自适应模式的档位: (JPEG 质量, 缩放比例, 帧率), 固定档位让自适应观看者尽量共用编码结果
+ADAPTIVE_LEVELS = ((80, 1.0, 30), (65, 1.0, 30), (50, 0.75, 20), (40, 0.5, 15), (30, 0.5, 10), (25, 0.25, 5))
+# 观看者可选的 JPEG 质量和缩放比例, 包含自适应模式的所有档位
+QUALITY_STEPS = tuple(sorted({level[0] for level in ADAPTIVE_LEVELS} | {95}))
+SCALE_STEPS = tuple(sorted({level[1] for level in ADAPTIVE_LEVELS}))
+
+def snap_profile(quality, scale):
+    # 取最接近的档位, quality 为 None(默认质量)时不变
+    if quality is not None:
+        quality = min(QUALITY_STEPS, key=lambda step: abs(step - quality))
+    return quality, min(SCALE_STEPS, key=lambda step: abs(step - scale))
+
+class AdaptiveRate:
+    # 发送耗时的滑动平均超过目标值时降一档, 持续远低于目标值时升一档
+    def __init__(self, target_latency=0.2, level=0):
+        self.target_latency = target_latency
+        self.level = level
+        self.write_time = 0.0  # 发送耗时的滑动平均(s)
+        self.changed = time.monotonic()
+
+    @property
+    def settings(self):
+        return ADAPTIVE_LEVELS[self.level]
+
+    def update(self, write_time, now):
+        self.write_time += (write_time - self.write_time) * 0.2
+        # 调整后至少等一段时间, 让滑动平均反映新档位的耗时
+        if self.write_time > self.target_latency and self.level < len(ADAPTIVE_LEVELS) - 1 and now - self.changed > 0.5:
+            self.level += 1
+        elif self.write_time < self.target_latency * 0.25 and self.level > 0 and now - self.changed > 2.0:
+            self.level -= 1
+        else:
+            return False
+        self.changed = now
+        return True
+
+class ChangeDetector:
+    # 把画面缩成 32x24 的灰度缩略图, 每个像素是一块区域的平均值, 噪声被平均掉, 局部的运动仍能反映出来
+    # 与上一次编码的画面比较, 缓慢的变化累积到阈值时也会被发现
+    def __init__(self, threshold=6.0, heartbeat=2.0, size=(32, 24)):
+        self.threshold = threshold  # 缩略图上最大的灰度差(0-255), 小于阈值视为没有变化
+        self.heartbeat = heartbeat
+        self.size = size
+        self.reference = None
+        self.last_change = None
+
+    def thumbnail(self, frame=None, jpeg=None):
+        if frame is None:
+            # 直通模式下让解码器直接输出 1/8 的灰度画面
+            frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+            if frame is None:
+                return None
+        thumb = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        if thumb.ndim == 3:
+            thumb = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+        return thumb
+
+    def changed(self, now, frame=None, jpeg=None, force=False):
+        thumb = self.thumbnail(frame, jpeg)
+        if (not force and thumb is not None and self.reference is not None and now - self.last_change < self.heartbeat
+                and cv2.norm(thumb, self.reference, cv2.NORM_INF) < self.threshold):
+            return False
+        self.reference = thumb
+        self.last_change = now
+        return True
+
+class JpegBroadcaster:
+    def __init__(self, camera, quality=None, encoder=None, change_threshold=None, heartbeat=2.0):
+        self.camera = camera
+        # quality 为 None 时使用编码后端的默认质量, 直通模式下不起作用
+        self.quality = quality
+        # 编码后端, 默认在启动时选择最快的可用后端, 见 jpeg_encoder
+        self.encoder = select_encoder() if encoder is None else encoder
+        # change_threshold 为 None 时每一帧都编码
+        self.detector = None if change_threshold is None else ChangeDetector(change_threshold, heartbeat)
+
+        self.cond = threading.Condition()
+        self.seq = 0  # 与 Camera 的画面序号相同
+        self.timestamp = None  # 画面的采集时间
+        self.jpeg = None  # 默认画质的编码结果
+        self.parts = {}  # (质量, 缩放) -> 带 multipart 头的完整数据, 直接发给观看者
+        self.profiles = collections.Counter()  # 观看者正在使用的 (质量, 缩放) 及人数
+        self.clients = {}  # 观看者编号 -> 当前设置和发送耗时, 用于 stats()
+        self.client_ids = itertools.count(1)
+        self.viewers = 0
+        self.encoded = 0  # 已编码的帧数, 直通模式下为已转发的帧数
+        self.latency = PipelineStats()
+
+        self.th = threading.Thread(target=self.encoder_task, daemon=True)
+        self.th.start()
+
+    def encode(self, frame, quality, scale):
+        if scale != 1.0:
+            frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        jpeg = self.encoder.encode(frame, self.quality if quality is None else quality)
+        if jpeg is None:
+            print('JPEG 编码失败')
+        return jpeg
+
+    def transcode(self, jpeg, quality, scale):
+        # 直通模式下转换摄像头输出的 JPEG, 缩小时让解码器直接输出 1/2 或 1/4 的画面
+        if quality is None and scale == 1.0:
+            return jpeg
+        if scale <= 0.25:
+            flags, scale = cv2.IMREAD_REDUCED_COLOR_4, scale * 4
+        elif scale <= 0.5:
+            flags, scale = cv2.IMREAD_REDUCED_COLOR_2, scale * 2
+        else:
+            flags = cv2.IMREAD_COLOR
+        frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), flags)
+        if frame is None:
+            print('JPEG 解码失败')
+            return None
+        return self.encode(frame, quality, scale)
+
+    def encoder_task(self):
+        seq = 0
+        while True:
+            with self.cond:
+                if not self.viewers:
+                    self.cond.wait_for(lambda: self.viewers > 0)
+                    seq = 0  # 没有观看者期间的帧不算跳过
+                profiles = list(self.profiles)
+                # 有观看者使用了还没有编码结果的画质时必须编码
+                force = any(key not in self.parts for key in profiles)
+            if getattr(self.camera, 'passthrough', False):
+                result = self.camera.wait_for_jpeg(seq, timeout=1.0)
+                if result is None:
+                    continue
+                self.count_skipped(result[0] - seq - 1 if seq else 0)
+                seq, timestamp, jpeg = result
+                if self.detector is not None and not self.detector.changed(time.monotonic(), jpeg=jpeg, force=force):
+                    self.latency.count('unchanged_skipped')
+                    continue
+                jpegs = {key: self.transcode(jpeg, *key) for key in profiles}
+            else:
+                lease = self.camera.lease_frame(seq, timeout=1.0)
+                if lease is None:
+                    continue
+                with lease:
+                    self.count_skipped(lease.seq - seq - 1 if seq else 0)
+                    seq = lease.seq
+                    timestamp = lease.timestamp
+                    if self.detector is not None and not self.detector.changed(time.monotonic(), lease.frame, force=force):
+                        self.latency.count('unchanged_skipped')
+                        continue
+                    jpegs = {key: self.encode(lease.frame, *key) for key in profiles}
+            self.latency.record('encode', time.monotonic() - timestamp)
+            self.publish(seq, timestamp, {key: jpeg for key, jpeg in jpegs.items() if jpeg is not None})
+
+    def count_skipped(self, skipped):
+        if skipped > 0:
+            # 编码跟不上采集而跳过的帧
+            self.latency.count('encoder_skipped', skipped)
+
+    def publish(self, seq, timestamp, jpegs):
+        parts = {key: b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n' for key, jpeg in jpegs.items()}
+        with self.cond:
+            self.seq = seq
+            self.timestamp = timestamp
+            self.jpeg = jpegs.get((None, 1.0))
+            self.parts = parts
+            self.encoded += 1
+            self.cond.notify_all()
+
+    def add_viewer(self, key=(None, 1.0)):
+        # 登记一个使用 (质量, 缩放) 的观看者, 有观看者时编码线程才工作
+        # stream() 以外的使用者(如录像)用默认画质登记后通过 wait_for_jpeg 取编码结果
+        with self.cond:
+            self.viewers += 1
+            self.profiles[key] += 1
+            self.cond.notify_all()
+
+    def remove_viewer(self, key=(None, 1.0)):
+        with self.cond:
+            self.viewers -= 1
+            self.profiles[key] -= 1
+            if not self.profiles[key]:
+                del self.profiles[key]
+
+    def wait_for_jpeg(self, after_seq=0, timeout=None):
+        # 等待序号大于 after_seq 的默认画质编码结果, 返回 (序号, 采集时间, JPEG 数据), 超时返回 None
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.jpeg is not None and self.seq > after_seq, timeout):
+                return None
+            return self.seq, self.timestamp, self.jpeg
+
+    def stream(self, fps=None, quality=None, scale=1.0, adaptive=False, target_latency=0.2):
+        # multipart/x-mixed-replace 的响应生成器, 客户端断开时生成器被关闭, 观看者计数随之减少
+        # fps 为 None 时不限制帧率, quality 为 None 时使用默认质量
+        # adaptive 为 True 时忽略 fps, quality 和 scale, 按 target_latency(s) 自动调整
+        rate = AdaptiveRate(target_latency) if adaptive else None
+        if rate is not None:
+            quality, scale, fps = rate.settings
+        else:
+            quality, scale = snap_profile(quality, scale)
+        key = (quality, scale)
+        client = next(self.client_ids)
+        with self.cond:
+            self.clients[client] = {'quality': quality, 'scale': scale, 'fps': fps, 'adaptive': adaptive, 'write_ms': 0.0}
+        self.add_viewer(key)
+        try:
+            seq = 0
+            encoded = None  # 已取得的最新编码结果对应的 self.encoded, 用于统计跳过的帧
+            last_sent = None
+            while True:
+                if fps and last_sent is not None:
+                    # 限制帧率: 等到下一帧的发送时间再取最新画面
+                    delay = last_sent + 1.0 / fps - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                with self.cond:
+                    if not self.cond.wait_for(lambda: key in self.parts and self.seq > seq, 1.0):
+                        continue
+                    skipped = self.encoded - encoded - 1 if encoded is not None else 0
+                    encoded = self.encoded
+                    seq = self.seq
+                    timestamp = self.timestamp
+                    part = self.parts[key]
+                if skipped > 0:
+                    # 观看者限制了帧率或发送跟不上而跳过的帧
+                    self.latency.count('viewer_skipped', skipped)
+                last_sent = time.monotonic()
+                # 发送缓冲区满时 yield 会阻塞, 耗时反映了网络的拥塞程度
+                yield part
+                now = time.monotonic()
+                self.latency.record('write', now - last_sent)
+                self.latency.record('sent', now - timestamp)
+                with self.cond:
+                    self.clients[client]['write_ms'] = round((now - last_sent) * 1000, 2)
+                    if rate is not None and rate.update(now - last_sent, now):
+                        quality, scale, fps = rate.settings
+                        self.profiles[key] -= 1
+                        if not self.profiles[key]:
+                            del self.profiles[key]
+                        key = (quality, scale)
+                        self.profiles[key] += 1
+                        self.clients[client].update(quality=quality, scale=scale, fps=fps)
+        finally:
+            self.remove_viewer(key)
+            with self.cond:
+                del self.clients[client]
+
+    def latency_stats(self):
+        # 各阶段距采集的耗时直方图(包括摄像头的 process/decode)和丢帧计数
+        stats = self.latency.snapshot()
+        camera_latency = getattr(self.camera, 'latency', None)
+        if camera_latency is not None:
+            camera_stats = camera_latency.snapshot()
+            stats['stages'].update(camera_stats['stages'])
+            stats['counters'].update(camera_stats['counters'])
+        stats['counters']['ring_full'] = getattr(self.camera, 'dropped_frames', 0)
+        stats['counters']['corrupt'] = getattr(self.camera, 'corrupt_frames', 0)
+        return stats
+
+    def stats(self):
+        with self.cond:
+            return {'viewers': self.viewers, 'encoded': self.encoded, 'seq': self.seq, 'encoder': self.encoder.name,
+                    'change_detection': self.detector is not None,
+                    'passthrough': getattr(self.camera, 'passthrough', False),
+                    'profiles': len(self.profiles), 'clients': [dict(client) for client in self.clients.values()]}
+
+if __name__ == '__main__':
+    from Camera import Camera
+    camera = Camera()
+    camera.camera_open()
+    broadcaster = JpegBroadcaster(camera)
+    stream = broadcaster.stream()
+    t0 = time.monotonic()
+    for n, part in enumerate(stream, 1):
+        if n % 30 == 0:
+            print('%.1f fps, %d bytes' % (n / (time.monotonic() - t0), len(part)))
+        if n == 300:
+            break
+    stream.close()
+    camera.camera_close()
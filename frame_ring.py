@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# encoding:utf-8
+# 预分配的画面缓冲区环, 采集线程轮流写入空闲的缓冲区, 避免每帧分配新数组
+# 读者租用最新一帧, 得到只读视图, 租用期间该缓冲区不会被覆盖
+# 所有方法都需要在创建时传入的锁内调用, FrameLease.release() 除外
+import numpy as np
+
+class FrameLease:
+    def __init__(self, ring, index, seq, timestamp):
+        self.ring = ring
+        self.index = index
+        self.seq = seq
+        self.timestamp = timestamp
+        self.frame = ring.views[index]  # 只读视图, 释放后不能再使用
+
+    def release(self):
+        if self.ring is not None:
+            with self.ring.lock:
+                self.ring.leases[self.index] -= 1
+            self.ring = None
+            self.frame = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+class FrameRing:
+    def __init__(self, lock, shape, dtype=np.uint8, count=4, max_count=8):
+        self.lock = lock
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.max_count = max_count  # 读者长时间占用缓冲区时最多扩充到的数量
+        self.buffers = []
+        self.views = []
+        self.leases = []
+        self.latest = None  # 最新一帧所在的缓冲区
+        for _ in range(count):
+            self.add_buffer()
+
+    def add_buffer(self):
+        buf = np.empty(self.shape, self.dtype)
+        view = buf.view()
+        view.flags.writeable = False
+        self.buffers.append(buf)
+        self.views.append(view)
+        self.leases.append(0)
+        return len(self.buffers) - 1
+
+    def acquire(self):
+        # 返回一个可以写入的缓冲区序号: 没有被租用, 也不是最新一帧, 都被占用时返回 None
+        # 总是优先使用序号小的缓冲区, 读者跟得上时只在两块缓冲区间交替, 数据留在 CPU 缓存中
+        for index, leases in enumerate(self.leases):
+            if index != self.latest and leases == 0:
+                return index
+        if len(self.buffers) < self.max_count:
+            return self.add_buffer()
+        return None
+
+    def lease(self, index, seq, timestamp):
+        self.leases[index] += 1
+        return FrameLease(self, index, seq, timestamp)
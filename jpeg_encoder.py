@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# encoding:utf-8
+# JPEG 编码后端: OpenCV, 以及安装了 libjpeg-turbo 的 Python 绑定(PyTurboJPEG 或 simplejpeg)时的对应后端
+# 所有后端接口相同: encode(frame, quality=None) 返回 JPEG 数据, 失败返回 None, frame 为 BGR 画面
+# select_encoder() 在启动时对可用的后端做一次简短测试, 选出最快的一个
+import time
+import glob
+import os
+import cv2
+import numpy as np
+
+try:
+    import turbojpeg
+except ImportError:
+    turbojpeg = None
+
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+# 画质预设: 名称 -> (JPEG 质量, 色度抽样)
+QUALITY_PRESETS = {
+    'low': (50, '420'),
+    'medium': (75, '420'),
+    'high': (90, '422'),
+    'max': (95, '444'),
+}
+
+# 默认与 cv2.imencode 不带参数时相同: 质量 95, 4:2:0 抽样
+DEFAULT_QUALITY = 95
+DEFAULT_SUBSAMPLING = '420'
+
+class OpenCVEncoder:
+    name = 'opencv'
+    sampling_factors = {
+        '420': cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420,
+        '422': cv2.IMWRITE_JPEG_SAMPLING_FACTOR_422,
+        '444': cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444,
+    }
+
+    def __init__(self, quality=DEFAULT_QUALITY, subsampling=DEFAULT_SUBSAMPLING):
+        self.quality = quality
+        self.subsampling = subsampling
+        self.sampling_factor = self.sampling_factors[subsampling]
+
+    def encode(self, frame, quality=None):
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), int(self.quality if quality is None else quality),
+                  int(cv2.IMWRITE_JPEG_SAMPLING_FACTOR), int(self.sampling_factor)]
+        ret, buffer = cv2.imencode('.jpg', frame, params)
+        if not ret:
+            return None
+        return buffer.tobytes()
+
+class TurboJpegEncoder:
+    # PyTurboJPEG, 需要系统中有 libturbojpeg
+    name = 'turbojpeg'
+
+    def __init__(self, quality=DEFAULT_QUALITY, subsampling=DEFAULT_SUBSAMPLING):
+        self.quality = quality
+        self.subsampling = subsampling
+        self.jpeg = turbojpeg.TurboJPEG()
+        self.subsample = {'420': turbojpeg.TJSAMP_420, '422': turbojpeg.TJSAMP_422, '444': turbojpeg.TJSAMP_444}[subsampling]
+
+    def encode(self, frame, quality=None):
+        return self.jpeg.encode(frame, quality=int(self.quality if quality is None else quality),
+                                pixel_format=turbojpeg.TJPF_BGR, jpeg_subsample=self.subsample)
+
+class SimpleJpegEncoder:
+    # simplejpeg 自带 libjpeg-turbo
+    name = 'simplejpeg'
+
+    def __init__(self, quality=DEFAULT_QUALITY, subsampling=DEFAULT_SUBSAMPLING):
+        self.quality = quality
+        self.subsampling = subsampling
+
+    def encode(self, frame, quality=None):
+        # simplejpeg 只接受内存连续的数组
+        return simplejpeg.encode_jpeg(np.ascontiguousarray(frame), quality=int(self.quality if quality is None else quality),
+                                      colorspace='BGR', colorsubsampling=self.subsampling)
+
+BACKENDS = {'opencv': OpenCVEncoder, 'turbojpeg': TurboJpegEncoder, 'simplejpeg': SimpleJpegEncoder}
+
+def available_encoders(quality=DEFAULT_QUALITY, subsampling=DEFAULT_SUBSAMPLING):
+    # 返回当前环境中可以创建的所有后端
+    encoders = [OpenCVEncoder(quality, subsampling)]
+    if turbojpeg is not None:
+        try:
+            encoders.append(TurboJpegEncoder(quality, subsampling))
+        except (OSError, RuntimeError) as e:
+            print('libturbojpeg 不可用:', e)
+    if simplejpeg is not None:
+        encoders.append(SimpleJpegEncoder(quality, subsampling))
+    return encoders
+
+def sample_images(size=(640, 480)):
+    # 标定图像作为测试画面, 没有时使用平滑过的随机画面
+    from CameraCalibration.CalibrationConfig import save_path
+    paths = sorted(glob.glob(os.path.join(save_path, '*.jpg')))
+    if not paths:
+        paths = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'CameraCalibration', 'calibration_images', '*.jpg')))
+    images = []
+    for path in paths:
+        image = cv2.imread(path)
+        if image is not None:
+            images.append(cv2.resize(image, size, interpolation=cv2.INTER_AREA))
+    if not images:
+        image = np.random.randint(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+        images.append(cv2.GaussianBlur(image, (9, 9), 0))
+    return images
+
+def benchmark(encoder, images, repeat=3, quality=None):
+    # 返回 (每帧最短耗时 ms, 平均每帧字节数)
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        size = 0
+        for image in images:
+            size += len(encoder.encode(image, quality))
+        elapsed = (time.perf_counter() - t0) / len(images)
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1000, size / len(images)
+
+def select_encoder(name='auto', quality=DEFAULT_QUALITY, subsampling=DEFAULT_SUBSAMPLING, preset=None):
+    # name 为 'auto' 时在可用后端中选最快的, 指定的后端不可用时退回 OpenCV
+    if preset is not None:
+        if preset not in QUALITY_PRESETS:
+            raise ValueError('未知的画质预设 %s, 可用: %s' % (preset, ', '.join(QUALITY_PRESETS)))
+        quality, subsampling = QUALITY_PRESETS[preset]
+    if name != 'auto':
+        for encoder in available_encoders(quality, subsampling):
+            if encoder.name == name:
+                return encoder
+        print('JPEG 编码后端 %s 不可用, 使用 opencv' % name)
+        return OpenCVEncoder(quality, subsampling)
+    encoders = available_encoders(quality, subsampling)
+    if len(encoders) == 1:
+        return encoders[0]
+    images = sample_images()[:3]
+    return min(encoders, key=lambda encoder: benchmark(encoder, images, repeat=2)[0])
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# encoding:utf-8
+# 视频管线各阶段的耗时统计, 单位微秒, 按 common.link_stats 的 2 的幂区间记录
+# 滚动窗口: 每半个窗口换一组直方图, 快照合并当前和上一组, 反映最近 window/2 ~ window 秒的情况
+# 计数器(丢帧等)从启动开始累计
+import time
+import threading
+from common.link_stats import Histogram
+
+class PipelineStats:
+    def __init__(self, window=60.0):
+        self.window = window
+        self.lock = threading.Lock()
+        self.current = {}  # 阶段名 -> Histogram
+        self.previous = {}
+        self.rotated = time.monotonic()
+        self.started = self.rotated  # 快照覆盖的起始时间
+        self.counters = {}
+
+    def rotate(self, now):
+        # 在 lock 内调用, 超过一个窗口没有数据时两组都清空
+        if now - self.rotated > self.window:
+            self.previous = {}
+            self.current = {}
+            self.started = self.rotated = now
+        elif now - self.rotated > self.window / 2:
+            self.previous = self.current
+            self.current = {}
+            self.started = self.rotated
+            self.rotated = now
+
+    def record(self, stage, seconds):
+        now = time.monotonic()
+        with self.lock:
+            self.rotate(now)
+            hist = self.current.get(stage)
+            if hist is None:
+                hist = self.current[stage] = Histogram()
+            hist.add(max(0, int(seconds * 1000000)))
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self.lock:
+            self.rotate(now)
+            stages = {}
+            for hists in (self.previous, self.current):
+                for stage, hist in hists.items():
+                    merged = stages.get(stage)
+                    if merged is None:
+                        merged = stages[stage] = Histogram(len(hist.counts))
+                    merged.merge(hist)
+            return {
+                'unit': 'us',
+                'window_s': round(now - self.started, 1),
+                'stages': {stage: hist.snapshot() for stage, hist in stages.items()},
+                'counters': dict(self.counters),
+            }
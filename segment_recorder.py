@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# encoding:utf-8
+# 后台录像: 按时长切分成多个文件写入磁盘
+# source='frames' 从 Camera 租用画面, 用 cv2.VideoWriter 编码为 MJPG(.avi) 或 H.264(.mp4)
+# source='jpeg' 直接使用已经编码好的 JPEG(直通模式下摄像头的输出, 否则为 JpegBroadcaster 的默认画质), 不再编码,
+# 依次写入 .mjpeg 文件(cv2.VideoWriter 不能写入已压缩的画面), 可以用 ffplay/VLC 播放或用 ffmpeg 转为其他格式
+# 读取画面和写文件在不同的线程, 中间的队列满时丢弃画面, 不会阻塞采集
+# 文件按固定帧率 fps 播放, 写入时按画面的采集时间重复或跳过画面, 丢帧或摄像头达不到标称帧率时播放时长仍与实际一致
+import os
+import re
+import time
+import queue
+import threading
+import cv2
+
+# fourcc -> 文件扩展名
+CONTAINERS = {'MJPG': '.avi', 'XVID': '.avi', 'avc1': '.mp4', 'H264': '.mp4', 'mp4v': '.mp4'}
+
+class SegmentRecorder:
+    def __init__(self, camera, directory, name='camera', broadcaster=None, source='auto', codec='MJPG',
+                 segment_seconds=60.0, fps=None, queue_size=30, keep_segments=None):
+        self.camera = camera
+        self.broadcaster = broadcaster
+        self.directory = directory
+        self.name = name
+        # auto: 直通模式下直接写摄像头的 JPEG, 否则编码画面
+        if source not in ('auto', 'frames', 'jpeg'):
+            raise ValueError('不支持的画面来源: %s' % source)
+        if source == 'auto':
+            source = 'jpeg' if getattr(camera, 'passthrough', False) else 'frames'
+        if source == 'jpeg' and not getattr(camera, 'passthrough', False) and broadcaster is None:
+            raise ValueError('source=jpeg 需要直通模式的摄像头或 JpegBroadcaster')
+        if source == 'frames' and codec not in CONTAINERS:
+            raise ValueError('不支持的编码格式: %s' % codec)
+        self.source = source
+        self.codec = codec
+        self.segment_seconds = segment_seconds
+        self.fps = fps if fps is not None else getattr(camera, 'fps', 30)  # VideoWriter 按固定帧率写入
+        if keep_segments is not None and (type(keep_segments) is not int or keep_segments < 1):
+            raise ValueError('keep_segments 必须是不小于 1 的整数: %r' % (keep_segments,))
+        self.keep_segments = keep_segments  # 最多保留的文件数, None 为不删除
+        # 本录像器写出的文件名: 名称_时间.扩展名, 不会匹配到以本名称开头的其他摄像头(如 front 与 front_wide)
+        extensions = sorted({ext[1:] for ext in CONTAINERS.values()} | {'mjpeg'})
+        self.segment_pattern = re.compile(r'%s_\d{8}-\d{6}\.(%s)$' % (re.escape(name), '|'.join(extensions)))
+        self.queue = queue.Queue(queue_size)
+
+        self.running = False
+        self.reader = None
+        self.writer = None
+        self.path = None  # 正在写入的文件
+        self.segments = []  # 本次录像已经完成的文件
+        self.frames = 0  # 已写入的帧数
+        self.repeated = 0  # 为保持帧率重复写入的次数
+        self.skipped = 0  # 超过帧率而跳过的帧数
+        self.dropped = 0  # 队列满而丢弃的帧数
+        self.bytes = 0  # 已完成的文件的总大小
+        self.last_error = None
+
+    def start(self):
+        if self.running:
+            return
+        if self.reader is not None:
+            # 上一次录像因出错停止, 先回收线程
+            self.stop()
+        os.makedirs(self.directory, exist_ok=True)
+        self.running = True
+        self.segments = []
+        self.last_error = None
+        read_task = self.read_jpegs if self.source == 'jpeg' else self.read_frames
+        self.reader = threading.Thread(target=read_task, daemon=True)
+        self.writer = threading.Thread(target=self.write_task, daemon=True)
+        self.reader.start()
+        self.writer.start()
+
+    def stop(self):
+        # 写完队列中剩余的画面, 关闭当前文件后返回
+        if self.reader is None:
+            return
+        self.running = False
+        self.reader.join()
+        # 写入线程出错退出后不再取队列, 不能阻塞在 put 上
+        while self.writer.is_alive():
+            try:
+                self.queue.put(None, timeout=0.5)
+                break
+            except queue.Full:
+                pass
+        self.writer.join()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.reader = self.writer = None
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def read_frames(self):
+        seq = 0
+        while self.running:
+            lease = self.camera.lease_frame(seq, timeout=1.0)
+            if lease is None:
+                continue
+            with lease:
+                seq = lease.seq
+                if self.queue.full():
+                    # 队列满时不拷贝画面
+                    self.dropped += 1
+                    continue
+                item = (lease.timestamp, lease.frame.copy())
+            self.put(item)
+
+    def read_jpegs(self):
+        passthrough = getattr(self.camera, 'passthrough', False)
+        source = self.camera if passthrough else self.broadcaster
+        if not passthrough:
+            # 作为一个默认画质的观看者登记, 与 /video_feed 的观看者共用编码结果
+            self.broadcaster.add_viewer()
+        try:
+            seq = 0
+            while self.running:
+                result = source.wait_for_jpeg(seq, timeout=1.0)
+                if result is None:
+                    continue
+                seq, timestamp, jpeg = result
+                self.put((timestamp, jpeg))
+        finally:
+            if not passthrough:
+                self.broadcaster.remove_viewer()
+
+    def open_segment(self, frame):
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        if self.source == 'jpeg':
+            self.path = os.path.join(self.directory, '%s_%s.mjpeg' % (self.name, stamp))
+            return open(self.path, 'wb')
+        self.path = os.path.join(self.directory, '%s_%s%s' % (self.name, stamp, CONTAINERS[self.codec]))
+        height, width = frame.shape[:2]
+        writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.codec), self.fps, (width, height))
+        if not writer.isOpened():
+            raise IOError('无法用 %s 编码写入 %s' % (self.codec, self.path))
+        return writer
+
+    def close_segment(self, output):
+        if self.source == 'jpeg':
+            output.close()
+        else:
+            output.release()
+        try:
+            self.bytes += os.path.getsize(self.path)
+        except OSError:
+            pass
+        self.segments.append(self.path)
+        self.path = None
+        self.prune()
+
+    def prune(self):
+        # 只保留最新的 keep_segments 个文件, 包括之前录像留下的同名文件
+        if not self.keep_segments:
+            return
+        names = sorted(name for name in os.listdir(self.directory) if self.segment_pattern.match(name))
+        for name in names[:-self.keep_segments]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError as e:
+                print('删除录像失败:', e)
+
+    def write_task(self):
+        output = None
+        started = None  # 当前文件第一帧的采集时间
+        written = 0  # 当前文件已写入的帧数(含重复)
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                timestamp, data = item
+                if output is not None and timestamp - started >= self.segment_seconds:
+                    # 先清空 output, 关闭出错时 finally 不会再关闭一次
+                    closing, output = output, None
+                    self.close_segment(closing)
+                if output is None:
+                    output = self.open_segment(data)
+                    started = timestamp
+                    written = 0
+                # 到这一帧的采集时间为止, 按 fps 应当写入的帧数
+                due = int((timestamp - started) * self.fps) + 1
+                if due <= written:
+                    self.skipped += 1
+                    continue
+                # 采集中断(如重新连接摄像头)时最多补 1 秒, 不一次写入大量重复画面
+                copies = min(due - written, max(1, int(self.fps)))
+                for _ in range(copies):
+                    output.write(data)
+                self.repeated += copies - 1
+                written = due
+                self.frames += 1
+        except Exception as e:
+            print('录像出错:', e)
+            self.last_error = str(e)
+            # 读取线程随后退出
+            self.running = False
+        finally:
+            if output is not None:
+                closing, output = output, None
+                self.close_segment(closing)
+
+    def status(self):
+        return {
+            'running': self.running,
+            'source': self.source,
+            'codec': 'MJPEG' if self.source == 'jpeg' else self.codec,
+            'segment_seconds': self.segment_seconds,
+            'path': self.path,
+            'segments': list(self.segments),
+            'frames': self.frames,
+            'repeated': self.repeated,
+            'skipped': self.skipped,
+            'dropped': self.dropped,
+            'bytes': self.bytes,
+            'queued': self.queue.qsize(),
+            'last_error': self.last_error,
+        }
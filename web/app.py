@@ -96,13 +96,16 @@ def gen_frames():
     A generator function that captures frames from the camera, encodes them,
     and yields them for the video stream.
     """
+    seq = 0
     while True:
-        frame = my_camera.frame
-        if frame is None:
-            time.sleep(0.1) # Wait a bit if no frame is available
-            continue
-        # Encode the frame in JPEG format
-        ret, buffer = cv2.imencode('.jpg', frame)
+        # Lease the next new frame so the capture thread cannot overwrite it while it is encoded
+        lease = my_camera.lease_frame(seq, timeout=1.0)
+        if lease is None:
+            continue # No frame yet, keep waiting
+        with lease:
+            seq = lease.seq
+            # Encode the frame in JPEG format
+            ret, buffer = cv2.imencode('.jpg', lease.frame)
         if not ret:
             print("Failed to encode frame")
             continue
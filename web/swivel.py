@@ -1,8 +1,8 @@
 import time
 import common.yaml_handle as yaml_handle
-from common.ros_robot_controller_sdk import Board
+from common.board_registry import get_board
 
-board = Board()
+board = get_board()
 def rotateCamera(val,vel=1):
 	#vel = speed in seconds
 	#angle should be 0-180